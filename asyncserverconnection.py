@@ -0,0 +1,210 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from os.path import getsize
+
+import oci
+
+from partsizer import partsizer, MiB
+from serverconnection import serverconnection, _mapped
+
+
+class asyncserverconnection:
+    #coroutine versions of serverconnection's exists/getFile/putFile/multiPutFile for use inside an event loop
+    #the OCI SDK only blocks, so every request runs on a dedicated thread pool of max_connections threads;
+    #one client (the wrapped serverconnection's) is shared by every task, and an asyncio semaphore keeps
+    #the number of requests waiting on that pool bounded however many transfers are multiplexed
+    def __init__(self, url, working_dir="", config_file="", storage_client=None, max_connections=16, server=None):
+        self.server = server if server is not None else serverconnection(url, working_dir, config_file, storage_client)
+        self.max_connections = max_connections
+        self.executor = ThreadPoolExecutor(max_workers=max_connections)
+        self.connections = None #created on first use so it binds to the running loop
+
+    @property
+    def working_dir(self):
+        return self.server.working_dir
+
+    @property
+    def print_location(self):
+        return self.server.print_location
+
+    def changeDir(self, working_dir):
+        self.server.changeDir(working_dir)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def _semaphore(self):
+        if self.connections is None:
+            self.connections = asyncio.Semaphore(self.max_connections)
+        return self.connections
+
+    async def _run(self, func, *args):
+        #runs one blocking SDK call/helper on the pool
+        async with self._semaphore():
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def _drain(self, jobs, sizer, call, running):
+        #takes jobs lazily from the `jobs` iterator and keeps sizer.concurrency of them running (read again as jobs
+        #finish, so adaptive changes apply) until it runs out or a job fails; call(job) gives the blocking function and
+        #its arguments, a falsy result is a failure. Thread futures are tracked in `running`, cancelling the task
+        #cannot interrupt them so cleanup has to wait for them
+        results = []
+        failed = []
+
+        async def one(job):
+            async with self._semaphore():
+                fut = asyncio.get_running_loop().run_in_executor(self.executor, *call(job))
+                running.add(fut)
+                fut.add_done_callback(running.discard)
+                return job, await asyncio.shield(fut)
+
+        pending = set()
+        try:
+            while True:
+                while not len(failed) and len(pending) < sizer.concurrency:
+                    job = next(jobs, None)
+                    if job is None:
+                        break
+                    pending.add(asyncio.ensure_future(one(job)))
+                if not len(pending):
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    job, result = task.result()
+                    if not result:
+                        failed.append(job)
+                    else:
+                        results.append((job, result))
+        except asyncio.CancelledError:
+            for task in pending:
+                task.cancel()
+            raise
+        return results, failed
+
+    async def _settle(self, running):
+        #waits for thread calls still running after a cancellation, they keep using the file until they return
+        if len(running):
+            await asyncio.wait(running)
+
+    async def exists(self, namespace, bucket_name, filename, attempts=10):
+        for i in range(attempts):
+            try:
+                return await self._run(self.server.headObject, namespace, bucket_name, filename) is not None
+            except oci.exceptions.ServiceError:
+                continue
+        return False
+
+    async def getFile(self, namespace, bucket_name, object_name, filename="", chunk_size=0, attempts=10, workers=1, max_workers=16) -> str:
+        #same contract as serverconnection.getFile (chunk_size 0 sizes ranges automatically); if the task is cancelled
+        #the partial file is removed
+        local_filename = object_name
+        if len(filename) != 0:
+            local_filename = filename
+        metadata = await self._run(self.server.headObject, namespace, bucket_name, object_name)
+        if metadata is None:
+            print("ERROR! Object", object_name, "not found.", file=self.print_location)
+            return ""
+        osize = int(metadata["content-length"])
+        fpath = os.path.join(self.working_dir, local_filename)
+        ppath = fpath + ".part"
+        with open(ppath, 'wb') as f:
+            f.truncate(osize)
+        if chunk_size:
+            sizer = partsizer.fixed(osize, chunk_size, workers, max_parts=0)
+        else: #same bounds as serverconnection.getFile, ranges are held in memory until written
+            sizer = partsizer(osize, workers, max_workers, min_part=MiB, max_part=64*MiB, max_parts=0)
+
+        def plan():
+            pos = 0
+            while pos < osize:
+                size = sizer.nextSize(osize-pos)
+                yield pos, pos+size-1
+                pos += size
+
+        running = set()
+        fd = os.open(ppath, os.O_RDWR | getattr(os, "O_BINARY", 0))
+
+        def fetch(cur):
+            return self.server._getRange, namespace, bucket_name, object_name, fd, cur[0], cur[1], attempts, sizer
+
+        try:
+            done, failed = await self._drain(plan(), sizer, fetch, running)
+        except asyncio.CancelledError:
+            await self._settle(running)
+            os.close(fd)
+            os.remove(ppath)
+            raise
+        os.close(fd)
+        if len(failed):
+            print("File at", local_filename, "could not be fully downloaded, cleaning up.", file=self.print_location)
+            os.remove(ppath)
+            return ""
+        os.replace(ppath, fpath)
+        print("SUCCESS!", file=self.print_location)
+        return local_filename
+
+    async def putFile(self, namespace, bucket_name, filename, object_name="", attempts=10, tier="", replace_existing=True) -> bool:
+        if len(object_name) == 0:
+            object_name = filename
+        metadata = await self._run(self.server.headObject, namespace, bucket_name, object_name)
+        if metadata is not None and not replace_existing:
+            print("Object exists with size", metadata["content-length"], file=self.print_location)
+            return False
+        fpath = os.path.join(self.working_dir, filename)
+        if await self._run(self.server._putLocal, namespace, bucket_name, object_name, fpath, tier, attempts):
+            print("SUCCESS!", file=self.print_location)
+            return True
+        print("FAILURE!", file=self.print_location)
+        return False
+
+    async def multiPutFile(self, namespace, bucket_name, filename, object_name="", chunk_size=0, attempts=10, tier="", replace_existing=True, workers=1, max_workers=16) -> bool:
+        #same contract as serverconnection.multiPutFile (chunk_size 0 sizes parts automatically); on failure or
+        #cancellation the multipart upload is aborted
+        if len(object_name) == 0:
+            object_name = filename
+        metadata = await self._run(self.server.headObject, namespace, bucket_name, object_name)
+        if metadata is not None and not replace_existing:
+            print("Object exists with size", metadata["content-length"], file=self.print_location)
+            return False
+        up_id = await self._run(self.server._createUpload, namespace, bucket_name, object_name, tier)
+        if up_id is None:
+            return False
+        fpath = os.path.join(self.working_dir, filename)
+        fsize = getsize(fpath)
+        sizer = partsizer.fixed(fsize, chunk_size, workers) if chunk_size else partsizer(fsize, workers, max_workers)
+
+        def plan():
+            offset = 0
+            part_num = 1
+            while offset < fsize:
+                size = sizer.nextSize(fsize-offset, part_num)
+                yield offset, size, part_num
+                offset += size
+                part_num += 1
+
+        running = set()
+        with _mapped(fpath) as view: #part bodies are slices of the mapped file
+
+            def send(cur):
+                return self.server._uploadPart, namespace, bucket_name, object_name, up_id, cur[2], view[cur[0]:cur[0]+cur[1]], attempts, sizer
+
+            try:
+                done, failed = await self._drain(plan(), sizer, send, running)
+                if not len(failed):
+                    commits = [oci.object_storage.models.CommitMultipartUploadPartDetails(part_num=cur[2], etag=etag) for cur, etag in done]
+                    if await self._run(self.server._commitUpload, namespace, bucket_name, object_name, up_id, commits, attempts):
+                        print("SUCCESS!", file=self.print_location)
+                        return True
+            except asyncio.CancelledError:
+                await asyncio.shield(self._abort(namespace, bucket_name, object_name, up_id, running))
+                raise
+            finally:
+                await self._settle(running) #parts still uploading hold slices of the mapping
+        print("FAILURE! Aborting multipart upload.", file=self.print_location)
+        await self._abort(namespace, bucket_name, object_name, up_id, running)
+        return False
+
+    async def _abort(self, namespace, bucket_name, object_name, up_id, running):
+        await self._settle(running)
+        await self._run(self.server._abortUpload, namespace, bucket_name, object_name, up_id)
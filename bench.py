@@ -0,0 +1,188 @@
+#transfer benchmarks against fakestorage, no cloud access needed
+#usage: python bench.py [--sizes 1 16 128] [--list-sizes 100 1000 10000] [--latency 0.02] [--bandwidth 0] [--json out.json]
+#reports wall time, throughput, requests made (by operation) and peak traced python memory for every case
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError: #windows
+    resource = None
+
+from fakestorage import fakestorage
+from filemanager import filemanager
+from partsizer import MiB
+from serverconnection import serverconnection
+
+NAMESPACE = "bench"
+BUCKET = "bench"
+
+
+def _fill(path, size, block=4*MiB):
+    #random-ish content without holding the whole file in memory
+    with open(path, "wb") as f:
+        left = size
+        while left:
+            n = min(block, left)
+            f.write(os.urandom(n))
+            left -= n
+
+
+def _measure(fake, case, nbytes, call, memory=True, client=None):
+    #runs call() once and returns the measurements for it, client (a serverconnection/filemanager) adds its list_io time
+    fake.resetStats()
+    if client is not None:
+        client.resetStats()
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        ok = call()
+    finally:
+        seconds = time.perf_counter()-start
+        peak = tracemalloc.get_traced_memory()[1] if memory else None
+        if memory:
+            tracemalloc.stop()
+    stats = fake.stats()
+    list_io = sum(op["seconds"] for op in client.stats()["list_io"].values()) if client is not None else 0.0
+    return {
+        "case": case,
+        "ok": bool(ok),
+        "bytes": nbytes,
+        "seconds": seconds,
+        "throughput": nbytes/seconds if seconds > 0 else 0.0,
+        "requests": stats["requests"],
+        "calls": stats["calls"],
+        "peak_memory": peak,
+        "list_io_seconds": list_io
+    }
+
+
+def benchTransfers(fake, workdir, sizes, workers, memory=True):
+    server = serverconnection("", workdir, storage_client=fake, quiet=True)
+    server.print_location = open(os.devnull, "w")
+    results = []
+    try:
+        #first calls pay for lazy imports and spinner setup, keep that out of the numbers
+        _fill(os.path.join(workdir, "warmup"), 1024)
+        server.putFile(NAMESPACE, BUCKET, "warmup")
+        server.multiPutFile(NAMESPACE, BUCKET, "warmup", workers=workers)
+        server.getFile(NAMESPACE, BUCKET, "warmup", "warmup.get", workers=workers)
+        for size in sizes:
+            name = "obj-" + str(size)
+            _fill(os.path.join(workdir, name), size)
+            results.append(_measure(fake, "putFile " + _human(size), size,
+                                    lambda: server.putFile(NAMESPACE, BUCKET, name, name + ".put"), memory))
+            results.append(_measure(fake, "multiPutFile " + _human(size) + " auto", size,
+                                    lambda: server.multiPutFile(NAMESPACE, BUCKET, name, name + ".mp", workers=workers), memory))
+            results.append(_measure(fake, "multiPutFile " + _human(size) + " 10MiB", size,
+                                    lambda: server.multiPutFile(NAMESPACE, BUCKET, name, name + ".mp", 10*MiB, workers=workers), memory))
+            results.append(_measure(fake, "getFile " + _human(size) + " auto", size,
+                                    lambda: server.getFile(NAMESPACE, BUCKET, name + ".put", name + ".get", workers=workers), memory))
+            results.append(_measure(fake, "getFile " + _human(size) + " 8MiB", size,
+                                    lambda: server.getFile(NAMESPACE, BUCKET, name + ".put", name + ".get", 8*MiB, workers=workers), memory))
+            for suffix in ("", ".get"):
+                os.remove(os.path.join(workdir, name + suffix))
+    finally:
+        server.print_location.close()
+    return results
+
+
+def benchLists(fake, workdir, list_sizes, memory=True):
+    #tracking bookkeeping: trackLocal/exists/readList on lists of n files, reopening the list, and importing a bucket
+    #prefix of n objects into an empty list and again after a tenth of them were deleted
+    results = []
+    for n in list_sizes:
+        ldir = os.path.join(workdir, "list-" + str(n))
+        os.mkdir(ldir)
+        names = ["f" + str(i) for i in range(n)]
+        for name in names:
+            open(os.path.join(ldir, name), "wb").close()
+        filelist = os.path.join(ldir, "files.json")
+        fm = filemanager("", ldir, filelist=filelist, storage_client=fake, quiet=True)
+        fm.print_location = open(os.devnull, "w")
+        results.append(_measure(fake, "trackLocal x" + str(n), 0,
+                                lambda: all([fm.trackLocal(NAMESPACE, BUCKET, name) for name in names]), memory, fm))
+        results.append(_measure(fake, "exists x" + str(n), 0, lambda: all([fm.exists(name) for name in names]), memory, fm))
+        results.append(_measure(fake, "readList " + str(n), 0, lambda: len(fm.readList()["files"]) == n, memory, fm))
+        fm.print_location.close()
+        fm.close()
+        results.append(_measure(fake, "reopen " + str(n), 0,
+                                lambda: filemanager("", ldir, filelist=filelist, storage_client=fake, quiet=True).close() is None, memory))
+        prefix = "import-" + str(n) + "/"
+        latency, fake.latency = fake.latency, 0.0 #setting up the bucket is not what is measured
+        for name in names:
+            fake.put_object(NAMESPACE, BUCKET, prefix + name, b"")
+        fm = filemanager("", ldir, filelist=os.path.join(ldir, "imported.json"), storage_client=fake, quiet=True)
+        fm.print_location = open(os.devnull, "w")
+        fake.latency = latency
+        results.append(_measure(fake, "trackCloudPrefix " + str(n), 0,
+                                lambda: fm.trackCloudPrefix(NAMESPACE, BUCKET, prefix)["added"] == n, memory, fm))
+        fake.latency = 0.0
+        for name in names[::10]:
+            fake.delete_object(NAMESPACE, BUCKET, prefix + name)
+        fake.latency = latency
+        results.append(_measure(fake, "re-import " + str(n), 0,
+                                lambda: fm.trackCloudPrefix(NAMESPACE, BUCKET, prefix)["deleted"] == len(names[::10]), memory, fm))
+        fm.print_location.close()
+        fm.close()
+        shutil.rmtree(ldir)
+    return results
+
+
+def _human(n):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if n < 1024 or unit == "GiB":
+            return (str(int(n)) if n == int(n) else "%.1f" % n) + unit
+        n /= 1024
+
+
+def report(results, out=sys.stdout):
+    print("%-28s %4s %10s %12s %9s %12s %10s" % ("case", "ok", "seconds", "MiB/s", "requests", "peak mem", "list io"), file=out)
+    for r in results:
+        print("%-28s %4s %10.3f %12s %9d %12s %10s" % (
+            r["case"], "yes" if r["ok"] else "NO", r["seconds"],
+            "%.1f" % (r["throughput"]/MiB) if r["bytes"] else "-", r["requests"],
+            _human(r["peak_memory"]) if r["peak_memory"] is not None else "-",
+            "%.3f" % r["list_io_seconds"] if r["list_io_seconds"] else "-"), file=out)
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print("process max rss:", _human(rss if sys.platform == "darwin" else rss*1024), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark transfers and file tracking against an in-process fake object storage.")
+    parser.add_argument("--sizes", type=float, nargs="*", default=[1, 16, 128], help="file sizes in MiB")
+    parser.add_argument("--list-sizes", type=int, nargs="*", default=[100, 1000, 10000], help="numbers of tracked files")
+    parser.add_argument("--workers", type=int, default=4, help="parts/ranges transferred concurrently")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every request")
+    parser.add_argument("--bandwidth", type=float, default=0, help="MiB/s per request (0 = unlimited)")
+    parser.add_argument("--link-bandwidth", type=float, default=0, help="MiB/s shared by all requests (0 = unlimited)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="chance a body transfer fails with a 503")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc (it slows down the list cases)")
+    parser.add_argument("--json", default="", help="also write the results to this file")
+    args = parser.parse_args(argv)
+    fake = fakestorage(args.latency, args.bandwidth*MiB, args.link_bandwidth*MiB, args.failure_rate, seed=args.seed)
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    try:
+        results = benchTransfers(fake, workdir, [int(s*MiB) for s in args.sizes], args.workers, not args.no_memory)
+        results += benchLists(fake, workdir, args.list_sizes, not args.no_memory)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        fake.close()
+    report(results)
+    if len(args.json):
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=5)
+    return 0 if all(r["ok"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+import json
+import os
+import time
+
+
+class checkpoint:
+    #small json file kept next to a transfer so an interrupted upload/download can pick up where it left off
+    def __init__(self, path, interval=1.0):
+        self.path = path
+        self.interval = interval #minimum seconds between throttled saves
+        self.last_save = 0.0
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return None
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError): #unreadable or half-written checkpoint, treat as missing
+            return None
+
+    def due(self):
+        #true once `interval` seconds have passed since the last save, used to throttle frequent updates
+        return time.monotonic()-self.last_save >= self.interval
+
+    def save(self, state):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path) #atomic, a crash leaves either the old or the new checkpoint
+        self.last_save = time.monotonic()
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def localStamp(path):
+    #identifies a local file version: if either changes the checkpoint is stale
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def mergeRanges(ranges):
+    #merges inclusive [start, end] byte ranges into a sorted, non-overlapping list
+    merged = []
+    for start, end in sorted(ranges):
+        if len(merged) and start <= merged[-1][1]+1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def missingRanges(done, size):
+    #inclusive [start, end] gaps in [0, size) not covered by the merged ranges in done
+    gaps = []
+    pos = 0
+    for start, end in done:
+        if start > pos:
+            gaps.append([pos, start-1])
+        pos = max(pos, end+1)
+    if pos < size:
+        gaps.append([pos, size-1])
+    return gaps
@@ -0,0 +1,324 @@
+import base64
+import hashlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import datetime, timezone
+
+import oci
+
+#operations that move object bodies, the ones failures are injected into by default
+DATA_OPS = ("get_object", "put_object", "upload_part")
+
+
+class _body:
+    #stands in for the streamed HTTP response get_object returns as .data
+    def __init__(self, content):
+        self.content = content
+        self.raw = io.BytesIO(content)
+
+    def iter_content(self, chunk_size=1024*1024):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i+chunk_size]
+
+
+class fakestorage:
+    #in-process stand-in for oci.object_storage.ObjectStorageClient, pass it as storage_client to serverconnection/filemanager
+    #implements the calls this package makes with the SDK's argument names, responses and ServiceErrors (404 for missing
+    #objects/uploads); bodies live in files under `root` (a temporary directory by default) so memory use is the client's
+    #latency: seconds added to every request, bandwidth: bytes/s of a single request's body (0 = unlimited),
+    #link_bandwidth: bytes/s shared by all requests at once (0 = unlimited), failure_rate: chance that a request in
+    #`failing` raises a 503 instead of doing anything
+    def __init__(self, latency=0.0, bandwidth=0, link_bandwidth=0, failure_rate=0.0, failing=DATA_OPS, root=None, seed=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.link_bandwidth = link_bandwidth
+        self.failure_rate = failure_rate
+        self.failing = set(failing)
+        self.owned = root is None
+        self.root = tempfile.mkdtemp(prefix="fakestorage-") if root is None else root
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.objects = {} #(namespace, bucket, name) -> record
+        self.names = [] #keys of self.objects in order, so listing a page does not sort the whole bucket
+        self.uploads = {} #upload id -> {"key", "tier", "parts": {num: (path, size, md5, etag)}}
+        self.link_free = 0.0 #when the shared link finishes the bytes already scheduled on it
+        self.calls = Counter()
+        self.bytes_in = 0 #body bytes received (puts and parts)
+        self.bytes_out = 0 #body bytes sent (gets)
+
+    def close(self):
+        #removes the stored bodies if the directory was created here
+        if self.owned:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+    def stats(self):
+        with self.lock:
+            return {"calls": dict(self.calls), "requests": sum(self.calls.values()), "bytes_in": self.bytes_in, "bytes_out": self.bytes_out}
+
+    def resetStats(self):
+        with self.lock:
+            self.calls.clear()
+            self.bytes_in = 0
+            self.bytes_out = 0
+
+    def _request(self, op):
+        #counts the call and decides whether it fails
+        with self.lock:
+            self.calls[op] += 1
+            fail = op in self.failing and self.random.random() < self.failure_rate
+        if fail:
+            time.sleep(self.latency)
+            raise oci.exceptions.ServiceError(503, "ServiceUnavailable", {}, "Injected failure in " + op)
+
+    def _transfer(self, nbytes):
+        #sleeps for the request's latency plus its body's time on the wire
+        now = time.monotonic()
+        finish = now+self.latency
+        if self.bandwidth:
+            finish += nbytes/self.bandwidth
+        if self.link_bandwidth and nbytes:
+            with self.lock:
+                start = max(now, self.link_free)
+                self.link_free = start+nbytes/self.link_bandwidth
+                finish = max(finish, self.link_free+self.latency)
+        if finish > now:
+            time.sleep(finish-now)
+
+    def _response(self, status, headers=None, data=None):
+        return oci.response.Response(status, headers or {}, data, None)
+
+    def _missing(self, code, message):
+        return oci.exceptions.ServiceError(404, code, {}, message)
+
+    def _checkBody(self, body):
+        #the SDK refuses anything else (memoryview and bytearray included) before sending a request
+        if not isinstance(body, (bytes, str)) and not hasattr(body, "read"):
+            raise TypeError("The body must be a string, bytes, or provide a read() method.")
+
+    def _store(self, body, expected=None):
+        #writes a bytes/str or file-like body to a new file, returns (path, size, base64 md5)
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        path = os.path.join(self.root, uuid.uuid4().hex)
+        digest = hashlib.md5()
+        size = 0
+        with open(path, "wb") as f:
+            if hasattr(body, "read"):
+                for block in iter(lambda: body.read(1024*1024), b""):
+                    digest.update(block)
+                    f.write(block)
+                    size += len(block)
+            else:
+                digest.update(body)
+                f.write(body)
+                size = len(body)
+        if expected is not None and expected != size:
+            os.remove(path)
+            raise oci.exceptions.ServiceError(400, "InvalidContentLength", {}, "Body is " + str(size) + " bytes, expected " + str(expected))
+        with self.lock:
+            self.bytes_in += size
+        return path, size, base64.b64encode(digest.digest()).decode("ascii")
+
+    def _replace(self, key, record):
+        with self.lock:
+            old = self.objects.get(key)
+            self.objects[key] = record
+            if old is None:
+                insort(self.names, key)
+        if old is not None:
+            os.remove(old["path"])
+
+    def _headers(self, rec):
+        headers = {"content-length": str(rec["size"]), "etag": rec["etag"], "storage-tier": rec["tier"],
+                   "last-modified": rec["time"].strftime("%a, %d %b %Y %H:%M:%S GMT")}
+        if rec["multipart_md5"] is not None:
+            headers["opc-multipart-md5"] = rec["multipart_md5"]
+        else:
+            headers["content-md5"] = rec["md5"]
+        return headers
+
+    def _record(self, path, size, md5, multipart_md5, tier):
+        return {"path": path, "size": size, "md5": md5, "multipart_md5": multipart_md5, "etag": str(uuid.uuid4()),
+                "tier": tier or "Standard", "time": datetime.now(timezone.utc)}
+
+    def head_object(self, namespace_name, bucket_name, object_name, **kwargs):
+        self._request("head_object")
+        self._transfer(0)
+        rec = self.objects.get((namespace_name, bucket_name, object_name))
+        if rec is None:
+            raise self._missing("ObjectNotFound", "The object '" + object_name + "' does not exist in bucket '" + bucket_name + "'")
+        return self._response(200, self._headers(rec))
+
+    def get_object(self, namespace_name, bucket_name, object_name, range=None, **kwargs):
+        self._request("get_object")
+        rec = self.objects.get((namespace_name, bucket_name, object_name))
+        if rec is None:
+            self._transfer(0)
+            raise self._missing("ObjectNotFound", "The object '" + object_name + "' does not exist in bucket '" + bucket_name + "'")
+        start, end, status = 0, rec["size"]-1, 200
+        if range is not None: #"bytes=a-b" or "bytes=a-"
+            first, last = range.split("=", 1)[1].split("-", 1)
+            start = int(first)
+            end = min(int(last), rec["size"]-1) if len(last) else rec["size"]-1
+            if start >= rec["size"] or end < start:
+                self._transfer(0)
+                raise oci.exceptions.ServiceError(416, "InvalidRange", {}, "Range " + range + " is not satisfiable")
+            status = 206
+        with open(rec["path"], "rb") as f:
+            f.seek(start)
+            content = f.read(end-start+1)
+        self._transfer(len(content))
+        with self.lock:
+            self.bytes_out += len(content)
+        headers = self._headers(rec)
+        headers["content-length"] = str(len(content))
+        if status == 206:
+            headers["content-range"] = "bytes " + str(start) + "-" + str(end) + "/" + str(rec["size"])
+        return self._response(status, headers, _body(content))
+
+    def put_object(self, namespace_name, bucket_name, object_name, put_object_body, content_length=None, storage_tier=None, **kwargs):
+        self._checkBody(put_object_body)
+        self._request("put_object")
+        path, size, md5 = self._store(put_object_body, content_length)
+        self._transfer(size)
+        rec = self._record(path, size, md5, None, storage_tier)
+        self._replace((namespace_name, bucket_name, object_name), rec)
+        return self._response(200, {"etag": rec["etag"], "opc-content-md5": md5, "last-modified": rec["time"].isoformat()})
+
+    def delete_object(self, namespace_name, bucket_name, object_name, **kwargs):
+        self._request("delete_object")
+        self._transfer(0)
+        with self.lock:
+            rec = self.objects.pop((namespace_name, bucket_name, object_name), None)
+            if rec is not None:
+                del self.names[bisect_left(self.names, (namespace_name, bucket_name, object_name))]
+        if rec is None:
+            raise self._missing("ObjectNotFound", "The object '" + object_name + "' does not exist in bucket '" + bucket_name + "'")
+        os.remove(rec["path"])
+        return self._response(204)
+
+    def list_objects(self, namespace_name, bucket_name, prefix=None, start=None, end=None, limit=1000, fields=None, start_after=None, **kwargs):
+        #pages by name like the service: next_start_with is the first name of the next page, None on the last one
+        self._request("list_objects")
+        self._transfer(0)
+        wanted = set(f.strip() for f in fields.split(",")) if fields else set()
+        prefix = prefix or ""
+        limit = max(1, min(limit or 1000, 1000))
+        names = [] #one more than the page, to know where the next one starts
+        with self.lock:
+            i = bisect_left(self.names, (namespace_name, bucket_name, max(prefix, start or "")))
+            while i < len(self.names) and len(names) <= limit:
+                key = self.names[i]
+                i += 1
+                if key[:2] != (namespace_name, bucket_name) or not key[2].startswith(prefix) or (end is not None and key[2] >= end):
+                    break
+                if start_after is None or key[2] > start_after:
+                    names.append((key[2], self.objects[key]))
+        page = names[:limit]
+        summaries = []
+        for name, rec in page:
+            summary = oci.object_storage.models.ObjectSummary(name=name)
+            if "size" in wanted:
+                summary.size = rec["size"]
+            if "etag" in wanted:
+                summary.etag = rec["etag"]
+            if "md5" in wanted:
+                summary.md5 = rec["multipart_md5"] or rec["md5"]
+            if "storageTier" in wanted:
+                summary.storage_tier = rec["tier"]
+            if "timeCreated" in wanted:
+                summary.time_created = rec["time"]
+            if "timeModified" in wanted:
+                summary.time_modified = rec["time"]
+            summaries.append(summary)
+        data = oci.object_storage.models.ListObjects(objects=summaries, prefixes=[],
+                                                     next_start_with=names[limit][0] if len(names) > limit else None)
+        return self._response(200, {}, data)
+
+    def create_multipart_upload(self, namespace_name, bucket_name, create_multipart_upload_details, **kwargs):
+        self._request("create_multipart_upload")
+        self._transfer(0)
+        details = create_multipart_upload_details
+        up_id = str(uuid.uuid4())
+        with self.lock:
+            self.uploads[up_id] = {"key": (namespace_name, bucket_name, details.object), "tier": details.storage_tier, "parts": {}}
+        data = oci.object_storage.models.MultipartUpload(namespace=namespace_name, bucket=bucket_name, object=details.object,
+                                                         upload_id=up_id, time_created=datetime.now(timezone.utc),
+                                                         storage_tier=details.storage_tier or "Standard")
+        return self._response(200, {}, data)
+
+    def _upload(self, namespace_name, bucket_name, object_name, upload_id):
+        upload = self.uploads.get(upload_id)
+        if upload is None or upload["key"] != (namespace_name, bucket_name, object_name):
+            raise self._missing("NoSuchUpload", "The upload '" + upload_id + "' does not exist")
+        return upload
+
+    def upload_part(self, namespace_name, bucket_name, object_name, upload_id, upload_part_num, upload_part_body, **kwargs):
+        self._checkBody(upload_part_body)
+        self._request("upload_part")
+        with self.lock:
+            upload = self._upload(namespace_name, bucket_name, object_name, upload_id)
+        path, size, md5 = self._store(upload_part_body, kwargs.get("content_length"))
+        self._transfer(size)
+        etag = hashlib.md5((upload_id + str(upload_part_num) + md5).encode("ascii")).hexdigest()
+        with self.lock:
+            old = upload["parts"].get(upload_part_num)
+            upload["parts"][upload_part_num] = (path, size, md5, etag)
+        if old is not None:
+            os.remove(old[0])
+        return self._response(200, {"etag": etag, "opc-content-md5": md5})
+
+    def list_multipart_upload_parts(self, namespace_name, bucket_name, object_name, upload_id, **kwargs):
+        self._request("list_multipart_upload_parts")
+        self._transfer(0)
+        with self.lock:
+            upload = self._upload(namespace_name, bucket_name, object_name, upload_id)
+            parts = sorted(upload["parts"].items())
+        return self._response(200, {}, [oci.object_storage.models.MultipartUploadPartSummary(part_number=num, etag=p[3], md5=p[2], size=p[1])
+                                        for num, p in parts])
+
+    def commit_multipart_upload(self, namespace_name, bucket_name, object_name, upload_id, commit_multipart_upload_details, **kwargs):
+        #joins the listed parts (in the order given, which must be ascending) into the object and drops the rest
+        self._request("commit_multipart_upload")
+        self._transfer(0)
+        commits = commit_multipart_upload_details.parts_to_commit
+        with self.lock:
+            upload = self._upload(namespace_name, bucket_name, object_name, upload_id)
+            nums = [c.part_num for c in commits]
+            if nums != sorted(set(nums)) or any(upload["parts"].get(c.part_num, (None,)*4)[3] != c.etag for c in commits):
+                raise oci.exceptions.ServiceError(400, "InvalidPart", {}, "Parts to commit are missing, out of order or have the wrong etag")
+            del self.uploads[upload_id]
+        path = os.path.join(self.root, uuid.uuid4().hex)
+        whole = hashlib.md5()
+        size = 0
+        with open(path, "wb") as out:
+            for num in nums:
+                part = upload["parts"][num]
+                with open(part[0], "rb") as f:
+                    shutil.copyfileobj(f, out, 1024*1024)
+                whole.update(base64.b64decode(part[2]))
+                size += part[1]
+        for part in upload["parts"].values():
+            os.remove(part[0])
+        multipart_md5 = base64.b64encode(whole.digest()).decode("ascii") + "-" + str(len(nums))
+        rec = self._record(path, size, None, multipart_md5, upload["tier"])
+        self._replace(upload["key"], rec)
+        return self._response(200, {"etag": rec["etag"], "opc-multipart-md5": multipart_md5})
+
+    def abort_multipart_upload(self, namespace_name, bucket_name, object_name, upload_id, **kwargs):
+        self._request("abort_multipart_upload")
+        self._transfer(0)
+        with self.lock:
+            upload = self._upload(namespace_name, bucket_name, object_name, upload_id)
+            del self.uploads[upload_id]
+        for part in upload["parts"].values():
+            os.remove(part[0])
+        return self._response(204)
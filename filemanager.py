@@ -1,27 +1,37 @@
 import os
-import json
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from os.path import getsize
 
+from filestore import filestore
+from fingerprint import fileFingerprint, fixedLayout, matchesRemote, partLayout
+from metrics import metrics
+from partsizer import partsizer
 from serverconnection import serverconnection
 
+#what upload/download print for outcomes other than a finished transfer
+MESSAGES = {
+    "untracked" : "File not tracked!",
+    "ondisk" : "File already exists on local machine and overwrite is turned off.",
+    "notincloud" : "File does not exist on server!",
+    "notondisk" : "No file to upload!",
+    "unchanged" : "Object is unchanged, skipping upload."
+}
+
 class filemanager:
-    def __init__(self, url, working_dir="", config_file="", filelist="files.json"):
+    def __init__(self, url, working_dir="", config_file="", filelist="files.json", storage_client=None, quiet=False):
         self.print_location = sys.stdout
         #manages files through server connection, keeps track of what files are in the cloud/computer, keeps metadata on local device
-        if not os.path.exists(filelist): #the file list needs creation
-            header = {
-                "ondisk" : 0, #number of files on disk
-                "incloud" : 0, #number of files in cloud
-                "diskspace" : 0, #space occupied on disk
-                "cloudspace" : 0, #space occupied in cloud
-                "files" : {} #files (indexed by full path)
-            }
-            with open(filelist, "w") as f:
-                json.dump(header, f, indent=5)
+        #the list is loaded once into an in-memory index, changes are journaled (see filestore); a missing list is created,
+        #an existing files.json (header counters + files indexed by full path) is picked up as-is
+        #the list and the connection record into one metrics object, see stats()
+        self.metrics = metrics()
         self.filelist = filelist
+        self.store = filestore(filelist, metrics=self.metrics)
         #initialize the connection to server
-        self.server = serverconnection(url, working_dir, config_file)
+        self.server = serverconnection(url, working_dir, config_file, storage_client, quiet=quiet, shared_metrics=self.metrics)
 
     def changeDir(self, wdir):
         self.server.changeDir(wdir)
@@ -33,100 +43,267 @@ class filemanager:
         if self.print_location != sys.stdout:
             self.print_location.close()
         self.print_location = sys.stdout
+
+    def setQuiet(self, quiet=True):
+        self.server.setQuiet(quiet)
+
+    def stats(self):
+        #requests/transfers of the connection and list_io of the tracking list, see serverconnection.stats
+        return self.server.stats()
+
+    def resetStats(self):
+        self.server.resetStats()
+
+    def close(self):
+        self.store.close()
+
     def readList(self):
-        clist = None
-        with open(self.filelist, "r") as f:
-            clist = json.load(f)
-        if clist is None:
-            print("Could not read list!", file=self.print_location)
-            return None
-        return clist
+        return self.store.asList()
 
     def writeList(self, nlist):
-        open(self.filelist).close() #clear
-        with open(self.filelist, "w") as f:
-            json.dump(nlist, f, indent=5)
+        self.store.replace(nlist)
+
+    def _key(self, filename):
+        return os.path.join(self.server.working_dir, filename)
 
     def exists(self, filename):
-        with open(self.filelist, "r") as f:
-            clist = self.readList()
-            if clist["files"].has_key(os.path.join(self.working_dir, filename)):
-                return True
-            else:
-                return False
+        return self._key(filename) in self.store
 
     def trackLocal(self, namespace, bucket_name, filename, multipart=False):
-        if not os.path.isfile(os.path.join(self.server.working_dir, filename)):
+        if not os.path.isfile(self._key(filename)):
             print("Track failed: file does not exist on local machine!", file=self.print_location)
             return False
-        clist = self.readList()
-        if clist is None:
-            return False
         if self.exists(filename):
             print("Track failed: file already tracked!", file=self.print_location)
             return False
         cfile = {
             "name" : filename,
             "dir" : self.server.working_dir,
-            "size" : getsize(os.path.join(self.working_dir, filename)),
+            "size" : getsize(self._key(filename)),
             "namespace" : namespace,
             "bucket" : bucket_name,
-            "multipart" : multipart
+            "multipart" : multipart,
+            "ondisk" : True,
+            "incloud" : False,
+            "cloudsize" : 0
         }
-        clist["files"][os.path.join(self.working_dir, filename)] = cfile
-        self.writeList(clist)
+        self.store.put(self._key(filename), cfile)
         print("Track successful!", file=self.print_location)
         return True
     def trackCloud(self, namespace, bucket_name, filename, multipart=False):
-        clist = self.readList()
-        if clist is None:
-            return False
-        if not self.server.exists(namespace, bucket_name, filename):
+        info = self.server.objectInfo(namespace, bucket_name, filename)
+        if info is None:
             print("Track failed: file does not exist on server!", file=self.print_location)
             return False
         if self.exists(filename):
             print("Track failed: file already tracked!", file=self.print_location)
             return False
+        ondisk = os.path.isfile(self._key(filename))
+        size = getsize(self._key(filename)) if ondisk else 0
         cfile = {
             "name": filename,
             "dir": self.server.working_dir,
-            "size": getsize(os.path.join(self.working_dir, filename)),
+            "size": size,
             "namespace": namespace,
             "bucket": bucket_name,
-            "multipart": multipart
+            "multipart": multipart,
+            "ondisk": ondisk,
+            "incloud": True,
+            "cloudsize": info["size"]
         }
-        clist["files"][os.path.join(self.working_dir, filename)] = cfile
-        self.writeList(clist)
+        self.store.put(self._key(filename), cfile)
         print("Track successful!", file=self.print_location)
         return True
 
-    def download(self, filename, overwrite=False, chunk_size=8192, attempts=10):
+    def trackCloudPrefix(self, namespace, bucket_name, prefix="", multipart=False, attempts=10):
+        #tracks every object under prefix from a paged listing (no HEAD per object) and applies the result in one store write
+        #re-running it is incremental: new objects are added, known ones get their remote size/etag/tier refreshed, and
+        #tracked objects of this bucket/prefix that are no longer listed are flagged deleted (incloud False) but kept
+        #a path already tracked for another bucket is left alone; returns counts of what changed
+        counts = dict.fromkeys(("listed", "added", "updated", "unchanged", "deleted", "skipped"), 0)
+        changes = {}
+        listed = set()
+        for obj in self.server.listObjects(namespace, bucket_name, prefix, attempts):
+            if obj.name.endswith("/"): #zero-byte "folder" markers made by the console
+                continue
+            counts["listed"] += 1
+            listed.add(obj.name)
+            key = self._key(obj.name)
+            remote = {"incloud": True, "cloudsize": obj.size, "etag": obj.etag or "", "tier": obj.storage_tier or ""}
+            cfile = self.store.get(key)
+            if cfile is None:
+                ondisk = os.path.isfile(key)
+                cfile = {
+                    "name": obj.name,
+                    "dir": self.server.working_dir,
+                    "size": getsize(key) if ondisk else 0,
+                    "namespace": namespace,
+                    "bucket": bucket_name,
+                    "multipart": multipart,
+                    "ondisk": ondisk,
+                    "incloud": False,
+                    "cloudsize": 0
+                }
+                counts["added"] += 1
+            elif (cfile["namespace"], cfile["bucket"], cfile["name"]) != (namespace, bucket_name, obj.name):
+                counts["skipped"] += 1
+                continue
+            elif all(cfile.get(k) == v for k, v in remote.items()) and not cfile.get("deleted"):
+                counts["unchanged"] += 1
+                continue
+            else:
+                counts["updated"] += 1
+            rec = dict(cfile)
+            rec.update(remote)
+            rec.pop("deleted", None)
+            changes[key] = rec
+        #anything of this bucket/prefix we believed was in the cloud but the listing did not return is gone
+        for key in self.store.keys():
+            cfile = self.store.get(key)
+            if cfile.get("incloud") and cfile["namespace"] == namespace and cfile["bucket"] == bucket_name \
+                    and cfile["name"].startswith(prefix) and cfile["name"] not in listed:
+                rec = dict(cfile)
+                rec.update(incloud=False, cloudsize=0, deleted=True)
+                changes[key] = rec
+                counts["deleted"] += 1
+        if len(changes):
+            self.store.putMany(changes)
+        print("Import successful:", counts["listed"], "objects listed,", counts["added"], "added,", counts["updated"], "updated,",
+              counts["deleted"], "flagged deleted.", file=self.print_location)
+        return counts
+
+    def _synced(self, filename, size, **fields):
+        #local file and object hold the same bytes after a transfer; clears a deleted flag left by trackCloudPrefix
+        rec = dict(self.store.get(self._key(filename)))
+        rec.update(fields, size=size, ondisk=True, incloud=True, cloudsize=size)
+        rec.pop("deleted", None)
+        self.store.put(self._key(filename), rec)
+
+    def _download(self, filename, overwrite, chunk_size, attempts, workers, report=None):
+        #does the work of download, returns (status, result) where status is a key of MESSAGES or "done"/"failed"
+        #report, if given, receives the range sizing used by getFile
         if not self.exists(filename):
-            print("File not tracked!", file=self.print_location)
-            return None
-        if os.path.isfile(os.path.join(self.server.working_dir, filename)) and not overwrite:
-            print("File already exists on local machine and overwrite is turned off.", file=self.print_location)
-            return None
-        clist = self.readList()
-        ns = clist["files"][os.path.join(self.working_dir, filename)]["namespace"]
-        bk = clist["files"][os.path.join(self.working_dir, filename)]["bucket"]
-        if not self.server.exists(ns, bk, filename):
-            print("File does not exist on server!", file=self.print_location)
-            return None
-        return self.server.getFile(ns, bk, filename, os.path.join(self.working_dir, filename), chunk_size, attempts)
-
-    def upload(self, filename, overwrite=False, chunk_size=8192, attempts=10, tier=""):
+            return "untracked", None
+        if os.path.isfile(self._key(filename)) and not overwrite:
+            return "ondisk", None
+        cfile = self.store.get(self._key(filename))
+        ns = cfile["namespace"]
+        bk = cfile["bucket"]
+        if not self.server.exists(ns, bk, cfile["name"]):
+            return "notincloud", None
+        result = self.server.getFile(ns, bk, cfile["name"], filename, chunk_size, attempts, workers, resume=True, report=report)
+        if not len(result):
+            return "failed", result
+        size = getsize(self._key(filename))
+        self._synced(filename, size)
+        return "done", result
+
+    def download(self, filename, overwrite=False, chunk_size=0, attempts=10, workers=1):
+        status, result = self._download(filename, overwrite, chunk_size, attempts, workers)
+        if status in MESSAGES:
+            print(MESSAGES[status], file=self.print_location)
+        return result
+
+    def _upload(self, filename, overwrite, chunk_size, attempts, tier, workers, max_inflight_bytes, multipart=None, report=None):
+        #does the work of upload, returns (status, result); multipart overrides the tracked setting when not None
+        #report, if given, receives the part sizing used by multiPutFile
         if not self.exists(filename):
-            print("File not tracked!", file=self.print_location)
-            return None
-        if not os.path.isfile(os.path.join(self.server.working_dir, filename)):
-            print("No file to upload!", file=self.print_location)
-            return None
-        clist = self.readList()
-        ns = clist["files"][os.path.join(self.working_dir, filename)]["namespace"]
-        bk = clist["files"][os.path.join(self.working_dir, filename)]["bucket"]
-        mp = clist["files"][os.path.join(self.working_dir, filename)]["multipart"]
+            return "untracked", None
+        if not os.path.isfile(self._key(filename)):
+            return "notondisk", None
+        cfile = self.store.get(self._key(filename))
+        ns = cfile["namespace"]
+        bk = cfile["bucket"]
+        mp = cfile["multipart"] if multipart is None else multipart
+        prev = cfile.get("fingerprint")
+        size = getsize(self._key(filename))
+        #skip the transfer if the object already holds these bytes: one HEAD, no body
+        headers = self.server.headObject(ns, bk, cfile["name"])
+        if headers is not None and int(headers["content-length"]) == size:
+            layout = None
+            if "opc-multipart-md5" in headers: #hash with the part layout of our last upload, or a plain split
+                layout = prev["layout"] if prev is not None and "layout" in prev else fixedLayout(size, chunk_size or partsizer(size).part_size)
+            prev = fileFingerprint(self._key(filename), layout, prev)
+            if matchesRemote(prev, headers):
+                self._synced(filename, size, fingerprint=prev)
+                return "unchanged", True
+        report = {} if report is None else report
         if mp:
-            return self.server.multiPutFile(ns, bk, filename, os.path.join(self.working_dir, filename), chunk_size, attempts, tier, overwrite)
+            result = self.server.multiPutFile(ns, bk, filename, cfile["name"], chunk_size, attempts, tier, overwrite, workers, max_inflight_bytes, resume=True, report=report)
         else:
-            return self.server.putFile(ns, bk, filename, os.path.join(self.working_dir, filename), attempts, tier, overwrite)
+            result = self.server.putFile(ns, bk, filename, cfile["name"], attempts, tier, overwrite)
+        if not result: #keep any hashes, they are still valid for the local file
+            if prev is not None:
+                self.store.update(self._key(filename), fingerprint=prev)
+            return "failed", result
+        #remember what the object was built from (whole file or the parts actually sent) for the next comparison
+        fp = fileFingerprint(self._key(filename), partLayout(report["part_sizes"]) if mp else None, prev)
+        self._synced(filename, size, fingerprint=fp)
+        return "done", result
+
+    def upload(self, filename, overwrite=False, chunk_size=0, attempts=10, tier="", workers=1, max_inflight_bytes=0):
+        status, result = self._upload(filename, overwrite, chunk_size, attempts, tier, workers, max_inflight_bytes)
+        if status in MESSAGES:
+            print(MESSAGES[status], file=self.print_location)
+        return result
+
+    def _runMany(self, jobs, workers, max_connections, max_memory):
+        #runs (filename, size, method, call) jobs on one pool, largest first so big files start early and small ones fill in around them
+        #every transfer shares the server's connection and memory caps for the duration
+        summary = {}
+        saved = (self.server.connections, self.server.memory)
+        self.server.setLimits(max_connections, max_memory)
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                futures = {}
+                for filename, size, method, call in sorted(jobs, key=lambda j: -j[1]):
+                    futures[pool.submit(self._timed, call)] = (filename, size, method)
+                for fut in as_completed(futures):
+                    filename, size, method = futures[fut]
+                    status, seconds, error, sizing = fut.result()
+                    summary[filename] = {
+                        "status": status,
+                        "ok": status in ("done", "unchanged"),
+                        "method": method,
+                        "bytes": size if status == "done" else 0,
+                        "seconds": seconds,
+                        "error": error,
+                        "sizing": sizing
+                    }
+        finally:
+            self.server.connections, self.server.memory = saved
+        return summary
+
+    def _timed(self, call):
+        start = time.monotonic()
+        report = {}
+        try:
+            status, result = call(report=report)
+            return status, time.monotonic()-start, None, report
+        except Exception as e:
+            return "error", time.monotonic()-start, str(e), report
+
+    def uploadMany(self, filenames, overwrite=False, chunk_size=0, attempts=10, tier="", workers=4, part_workers=4,
+                   multipart_threshold=64*1024*1024, max_connections=16, max_memory=256*1024*1024):
+        #uploads many tracked files at once: files under multipart_threshold bytes go up whole with putFile, larger ones
+        #with multiPutFile using part_workers each; at most workers files, max_connections requests and max_memory bytes at a time
+        #returns {filename: {"status", "ok", "method", "bytes", "seconds", "error", "sizing"}} instead of a value per call,
+        #sizing holds the part sizes/concurrency chosen for multipart files (chunk_size 0 lets each file pick its own)
+        jobs = []
+        for filename in filenames:
+            size = getsize(self._key(filename)) if os.path.isfile(self._key(filename)) else 0
+            mp = size >= multipart_threshold
+            call = partial(self._upload, filename, overwrite, chunk_size, attempts, tier, part_workers, 0, mp)
+            jobs.append((filename, size, "multiPutFile" if mp else "putFile", call))
+        return self._runMany(jobs, workers, max_connections, max_memory)
+
+    def downloadMany(self, filenames, overwrite=False, chunk_size=0, attempts=10, workers=4, range_workers=4,
+                     max_connections=16, max_memory=256*1024*1024):
+        #downloads many tracked files at once, range_workers ranges per file, sharing the same caps as uploadMany
+        jobs = []
+        for filename in filenames:
+            cfile = self.store.get(self._key(filename))
+            size = cfile.get("cloudsize", 0) if cfile is not None else 0
+            call = partial(self._download, filename, overwrite, chunk_size, attempts, range_workers)
+            jobs.append((filename, size, "getFile", call))
+        return self._runMany(jobs, workers, max_connections, max_memory)
@@ -0,0 +1,184 @@
+import json
+import os
+import threading
+import time
+
+COUNTERS = ("ondisk", "incloud", "diskspace", "cloudspace")
+
+
+class filestore:
+    #tracked file records indexed by full path, kept in memory and persisted incrementally
+    #the snapshot keeps the files.json layout (header counters + "files"), so existing lists load as-is
+    #every change is appended to <filelist>.journal and folded back into the snapshot every `compact_every` entries
+    #time spent reading and writing is recorded as "list_io" in `metrics` if one is given
+    def __init__(self, filelist, compact_every=1000, sync=True, metrics=None):
+        self.filelist = filelist
+        self.metrics = metrics
+        self.journal = filelist + ".journal"
+        self.compact_every = compact_every
+        self.sync = sync #fsync each journal entry (crash safe) or leave it to the os
+        self.lock = threading.RLock()
+        self.files = {}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.pending = 0 #journal entries not yet in the snapshot
+        self.jfile = None
+        self.load()
+
+    def _io(self, op, began, nbytes=0):
+        if self.metrics is not None:
+            self.metrics.record("list_io", op, time.monotonic()-began, nbytes)
+
+    def load(self):
+        with self.lock:
+            began = time.monotonic()
+            self.files = {}
+            if os.path.isfile(self.filelist):
+                with open(self.filelist, "r") as f:
+                    self.files = json.load(f).get("files", {})
+            migrated = False
+            for key, rec in self.files.items():
+                migrated |= self._migrate(key, rec)
+            self.pending = 0
+            torn = False
+            if os.path.isfile(self.journal):
+                with open(self.journal, "r") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError: #torn write at the tail from a crash, everything before it is intact
+                            torn = True
+                            break
+                        self._apply(entry)
+                        self.pending += 1
+            self.counters = dict.fromkeys(COUNTERS, 0)
+            for rec in self.files.values():
+                self._count(rec, 1)
+            self._io("load", began, sum(os.path.getsize(p) for p in (self.filelist, self.journal) if os.path.isfile(p)))
+            #a torn tail has to go now: the next append would land on the same line and be lost with it
+            if migrated or self.pending or torn or not os.path.isfile(self.filelist):
+                self.compact()
+
+    def _migrate(self, key, rec):
+        #records written before the store existed have no location flags
+        if "ondisk" in rec:
+            return False
+        rec["ondisk"] = os.path.isfile(key)
+        rec["incloud"] = False #unknown until the next upload/download confirms it
+        rec["cloudsize"] = 0
+        return True
+
+    def _apply(self, entry):
+        if entry["op"] == "put":
+            self.files[entry["key"]] = entry["rec"]
+        elif entry["op"] == "del":
+            self.files.pop(entry["key"], None)
+
+    def _count(self, rec, sign):
+        if rec.get("ondisk"):
+            self.counters["ondisk"] += sign
+            self.counters["diskspace"] += sign*rec.get("size", 0)
+        if rec.get("incloud"):
+            self.counters["incloud"] += sign
+            self.counters["cloudspace"] += sign*rec.get("cloudsize", 0)
+
+    def _log(self, entries):
+        began = time.monotonic()
+        if self.jfile is None:
+            self.jfile = open(self.journal, "a")
+        data = "".join(json.dumps(e) + "\n" for e in entries)
+        self.jfile.write(data)
+        self.jfile.flush()
+        if self.sync:
+            os.fsync(self.jfile.fileno())
+        self._io("journal", began, len(data))
+        self.pending += len(entries)
+        if self.pending >= self.compact_every:
+            self.compact()
+
+    def __contains__(self, key):
+        return key in self.files
+
+    def __len__(self):
+        return len(self.files)
+
+    def get(self, key):
+        return self.files.get(key)
+
+    def keys(self):
+        with self.lock:
+            return list(self.files)
+
+    def put(self, key, rec):
+        self.putMany({key: rec})
+
+    def putMany(self, recs):
+        #adds/replaces several records with a single journal write
+        with self.lock:
+            for key, rec in recs.items():
+                if key in self.files:
+                    self._count(self.files[key], -1)
+                self.files[key] = rec
+                self._count(rec, 1)
+            self._log([{"op": "put", "key": k, "rec": r} for k, r in recs.items()])
+
+    def update(self, key, **fields):
+        #changes some fields of an existing record
+        with self.lock:
+            rec = dict(self.files[key])
+            rec.update(fields)
+            self.put(key, rec)
+
+    def remove(self, key):
+        with self.lock:
+            if key not in self.files:
+                return False
+            self._count(self.files.pop(key), -1)
+            self._log([{"op": "del", "key": key}])
+            return True
+
+    def header(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def asList(self):
+        #the whole list in the files.json layout
+        with self.lock:
+            clist = dict(self.counters)
+            clist["files"] = dict(self.files)
+            return clist
+
+    def replace(self, nlist):
+        #swaps in a whole list (files.json layout), counters are recomputed from the records
+        with self.lock:
+            self.files = dict(nlist["files"])
+            self.counters = dict.fromkeys(COUNTERS, 0)
+            for key, rec in self.files.items():
+                self._migrate(key, rec)
+                self._count(rec, 1)
+            self.compact()
+
+    def compact(self):
+        #writes a fresh snapshot and empties the journal, a crash in between only replays entries already applied
+        with self.lock:
+            began = time.monotonic()
+            tmp = self.filelist + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.asList(), f, indent=5)
+                f.flush()
+                os.fsync(f.fileno())
+                written = f.tell()
+            os.replace(tmp, self.filelist)
+            if self.jfile is not None:
+                self.jfile.close()
+                self.jfile = None
+            open(self.journal, "w").close()
+            self.pending = 0
+            self._io("compact", began, written)
+
+    def close(self):
+        with self.lock:
+            if self.pending:
+                self.compact()
+            if self.jfile is not None:
+                self.jfile.close()
+                self.jfile = None
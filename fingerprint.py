@@ -0,0 +1,87 @@
+import base64
+import hashlib
+import os
+
+
+def _b64(digest):
+    return base64.b64encode(digest).decode("ascii")
+
+
+def partLayout(sizes):
+    #compact form of a list of part sizes: [[size, count], ...] runs in part order
+    layout = []
+    for size in sizes:
+        if len(layout) and layout[-1][0] == size:
+            layout[-1][1] += 1
+        else:
+            layout.append([size, 1])
+    return layout
+
+
+def fixedLayout(file_size, part_size):
+    #layout of a file split into part_size parts, the last one shorter
+    layout = []
+    if file_size//part_size:
+        layout.append([part_size, file_size//part_size])
+    if file_size%part_size:
+        layout.append([file_size%part_size, 1])
+    return layout
+
+
+def fileFingerprint(path, layout=None, previous=None, block_size=1 << 20):
+    #size, mtime and content hash of a local file, in the form object storage reports them:
+    #layout None -> base64 md5 of the whole file (content-md5 of a single PUT)
+    #layout [[size, count], ...] -> base64 md5 of every part (what the multipart md5 of the object is built from)
+    #the hashes in `previous` are reused when size and mtime have not changed
+    st = os.stat(path)
+    fp = {"size": st.st_size, "mtime": st.st_mtime_ns}
+    if previous is not None and previous.get("size") == fp["size"] and previous.get("mtime") == fp["mtime"]:
+        if layout is None and "md5" in previous:
+            fp["md5"] = previous["md5"]
+            return fp
+        if layout is not None and previous.get("layout") == layout:
+            fp["layout"] = layout
+            fp["part_md5s"] = previous["part_md5s"]
+            return fp
+    if layout is None:
+        whole = hashlib.md5()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                whole.update(block)
+        fp["md5"] = _b64(whole.digest())
+        return fp
+    parts = []
+    with open(path, "rb") as f:
+        for part_size, count in layout:
+            for i in range(count):
+                part = hashlib.md5()
+                left = part_size
+                while left:
+                    block = f.read(min(block_size, left))
+                    if not len(block):
+                        break
+                    part.update(block)
+                    left -= len(block)
+                parts.append(_b64(part.digest()))
+    fp["layout"] = layout
+    fp["part_md5s"] = parts
+    return fp
+
+
+def multipartMd5(part_md5s):
+    #object storage's md5 for a multipart object: md5 of the concatenated binary part md5s, then -<number of parts>
+    whole = hashlib.md5()
+    for p in part_md5s:
+        whole.update(base64.b64decode(p))
+    return _b64(whole.digest()) + "-" + str(len(part_md5s))
+
+
+def matchesRemote(fp, headers):
+    #true if the head_object headers describe the same bytes as the local fingerprint
+    if headers is None or int(headers.get("content-length", -1)) != fp["size"]:
+        return False
+    if "md5" in fp:
+        return headers.get("content-md5") == fp["md5"]
+    if "part_md5s" in fp:
+        return headers.get("opc-multipart-md5") == multipartMd5(fp["part_md5s"])
+    return False
@@ -0,0 +1,23 @@
+import threading
+
+
+class bytebudget:
+    #shared cap on bytes held in memory by transfers running on different threads
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.used = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, n):
+        #blocks until n bytes fit, returns the amount taken (requests bigger than the whole budget take all of it)
+        n = min(n, self.capacity)
+        with self.cond:
+            while self.used+n > self.capacity:
+                self.cond.wait()
+            self.used += n
+        return n
+
+    def release(self, n):
+        with self.cond:
+            self.used -= n
+            self.cond.notify_all()
@@ -0,0 +1,45 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class metacache:
+    #head_object results keyed by (namespace, bucket, object), each kept for `ttl` seconds,
+    #least recently used entries are evicted past `max_entries`; None (no such object) is cached too
+    def __init__(self, ttl=30.0, max_entries=10000):
+        self.ttl = ttl #0 disables caching
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        #(True, headers) on a fresh hit, (False, None) otherwise
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic()-entry[0] > self.ttl:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def store(self, key, headers):
+        if not self.ttl:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic(), headers)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,110 @@
+import math
+import threading
+from bisect import bisect_left
+
+#upper bounds (seconds) of the latency histogram buckets, the last bucket takes everything slower
+BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 60.0, math.inf)
+#what the recorded operations are grouped by: single SDK calls, whole transfers, tracking list reads/writes
+KINDS = ("requests", "transfers", "list_io")
+
+
+class histogram:
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = bounds
+        self.counts = [0]*len(bounds)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        #upper bound of the bucket holding the q-th value, capped at the largest value seen
+        if not self.count:
+            return 0.0
+        rank = q*self.count
+        seen = 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "min": self.min if self.count else 0.0,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": [[b, n] for b, n in zip(self.bounds, self.counts) if n]
+        }
+
+
+class metrics:
+    #thread-safe per-operation counts, bytes and latency histograms, plus hooks that see every event as it happens
+    #each record() is one event: {"kind", "op", "seconds", "bytes", "ok", "retry"}; hooks run on the recording
+    #(often a worker) thread after the stats are updated, so they should be quick and must not raise
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hooks = []
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.ops = {kind: {} for kind in KINDS}
+
+    def addHook(self, hook):
+        with self.lock:
+            self.hooks = self.hooks+[hook]
+
+    def removeHook(self, hook):
+        with self.lock:
+            self.hooks = [h for h in self.hooks if h is not hook]
+
+    def record(self, kind, op, seconds, nbytes=0, ok=True, retry=False):
+        #retry: this attempt repeats one that failed (counted separately from errors, which are failed attempts)
+        with self.lock:
+            entry = self.ops[kind].get(op)
+            if entry is None:
+                entry = self.ops[kind][op] = {"count": 0, "errors": 0, "retries": 0, "bytes": 0, "seconds": 0.0, "latency": histogram()}
+            entry["count"] += 1
+            entry["retries"] += retry
+            entry["seconds"] += seconds
+            entry["latency"].add(seconds)
+            if ok:
+                entry["bytes"] += nbytes
+            else:
+                entry["errors"] += 1
+            hooks = self.hooks
+        if len(hooks):
+            event = {"kind": kind, "op": op, "seconds": seconds, "bytes": nbytes, "ok": ok, "retry": retry}
+            for hook in hooks:
+                hook(event)
+
+    def stats(self):
+        #snapshot: {kind: {op: {"count", "errors", "retries", "bytes", "seconds", "bytes_per_second", "latency"}}}
+        #bytes_per_second is bytes over the time spent in those operations (per connection for requests)
+        with self.lock:
+            out = {}
+            for kind, ops in self.ops.items():
+                out[kind] = {}
+                for op, e in ops.items():
+                    out[kind][op] = {
+                        "count": e["count"],
+                        "errors": e["errors"],
+                        "retries": e["retries"],
+                        "bytes": e["bytes"],
+                        "seconds": e["seconds"],
+                        "bytes_per_second": e["bytes"]/e["seconds"] if e["seconds"] > 0 else 0.0,
+                        "latency": e["latency"].summary()
+                    }
+            return out
@@ -0,0 +1,110 @@
+import math
+import threading
+import time
+
+MiB = 1024*1024
+#object storage multipart limits: parts of 10 MiB to 50 GiB (the last may be smaller), at most 10000 parts
+MIN_PART = 10*MiB
+MAX_PART = 50*1024*MiB
+MAX_PARTS = 10000
+
+
+class partsizer:
+    #picks part (upload) or range (download) sizes and concurrency for one transfer and adapts them as it runs:
+    #parts grow while requests finish faster than `target_seconds` (per-request overhead dominates) and shrink when
+    #they take much longer or fail; concurrency is raised while total throughput keeps improving and cut on errors
+    def __init__(self, object_size, workers=4, max_workers=16, start_size=16*MiB, min_part=MIN_PART, max_part=MAX_PART,
+                 max_parts=MAX_PARTS, target_seconds=2.0, error_rate=0.1, adaptive=True):
+        self.object_size = object_size
+        self.adaptive = adaptive
+        self.min_part = min_part
+        self.max_part = max_part
+        self.max_parts = max_parts
+        self.target_seconds = target_seconds
+        self.error_rate = error_rate
+        self.max_workers = max(1, max_workers)
+        self.concurrency = min(max(1, workers), self.max_workers)
+        #smallest size that still fits the object in max_parts, rounded up to a whole MiB
+        floor = math.ceil(object_size/max_parts/MiB)*MiB if max_parts else 0
+        self.part_size = min(max(start_size, min_part, floor), max_part)
+        self.lock = threading.Lock()
+        self.window = [] #(bytes, seconds, ok) since the last adjustment
+        self.window_start = time.monotonic()
+        self.last_throughput = 0.0
+        self.initial = {"part_size": self.part_size, "workers": self.concurrency}
+        self.requests = 0
+        self.errors = 0
+        self.transferred = 0
+        self.adjustments = []
+        self.started = time.monotonic()
+
+    @classmethod
+    def fixed(cls, object_size, part_size, workers, max_parts=MAX_PARTS):
+        #caller-chosen size and concurrency that are never adapted; parts only grow if the object would not fit in max_parts
+        return cls(object_size, workers, workers, part_size, part_size, part_size, max_parts, adaptive=False)
+
+    def nextSize(self, remaining, part_num=0):
+        #size of the next part given the bytes left; keeps the whole object within max_parts
+        with self.lock:
+            size = self.part_size
+            if self.max_parts and part_num:
+                parts_left = self.max_parts-part_num+1
+                if parts_left <= 1:
+                    return remaining
+                size = max(size, math.ceil(remaining/parts_left))
+            return min(size, remaining)
+
+    def record(self, nbytes, seconds, ok):
+        #called from worker threads after every request attempt
+        with self.lock:
+            self.requests += 1
+            if ok:
+                self.transferred += nbytes
+            else:
+                self.errors += 1
+            self.window.append((nbytes, seconds, ok))
+            if self.adaptive and len(self.window) >= max(4, 2*self.concurrency):
+                self._adjust()
+
+    def _adjust(self):
+        now = time.monotonic()
+        failures = sum(1 for w in self.window if not w[2])
+        good = [w for w in self.window if w[2]]
+        throughput = sum(w[0] for w in good)/max(now-self.window_start, 1e-9)
+        part_size, concurrency = self.part_size, self.concurrency
+        if failures/len(self.window) > self.error_rate:
+            #struggling: fewer, smaller requests so a retry costs less
+            concurrency = max(1, concurrency//2)
+            part_size = max(self.min_part, part_size//2)
+        elif len(good):
+            latency = sum(w[1] for w in good)/len(good)
+            if latency < self.target_seconds/2:
+                part_size = min(self.max_part, part_size*2)
+            elif latency > self.target_seconds*4:
+                part_size = max(self.min_part, part_size//2)
+            if throughput > self.last_throughput*1.05:
+                concurrency = min(self.max_workers, concurrency+1)
+            elif throughput < self.last_throughput*0.9:
+                concurrency = max(1, concurrency-1)
+        if (part_size, concurrency) != (self.part_size, self.concurrency):
+            self.adjustments.append({"at": round(now-self.started, 3), "part_size": part_size, "workers": concurrency,
+                                     "throughput": throughput})
+        self.part_size, self.concurrency = part_size, concurrency
+        self.last_throughput = throughput
+        self.window = []
+        self.window_start = now
+
+    def summary(self):
+        #the choices made, for the caller's transfer report
+        with self.lock:
+            elapsed = time.monotonic()-self.started
+            return {
+                "initial_part_size": self.initial["part_size"],
+                "initial_workers": self.initial["workers"],
+                "final_part_size": self.part_size,
+                "final_workers": self.concurrency,
+                "requests": self.requests,
+                "errors": self.errors,
+                "throughput": self.transferred/elapsed if elapsed > 0 else 0.0,
+                "adjustments": list(self.adjustments)
+            }
@@ -1,4 +1,10 @@
+import mmap
 import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from os.path import getsize
 
 import oci
@@ -8,20 +14,160 @@ from oci.object_storage import ObjectStorageClient
 from tqdm import tqdm
 import os
 
+from checkpoint import checkpoint, localStamp, mergeRanges, missingRanges
+from limits import bytebudget
+from metacache import metacache
+from metrics import metrics
+from partsizer import partsizer, MiB
+
+if hasattr(os, "pwrite"):
+    def _writeAt(fd, data, offset):
+        while len(data):
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+else: #no positional writes (windows), serialize seek+write
+    _write_lock = threading.Lock()
+    def _writeAt(fd, data, offset):
+        with _write_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            while len(data):
+                written = os.write(fd, data)
+                data = data[written:]
+
+@contextmanager
+def _mapped(fpath):
+    #read-only memoryview of a whole file backed by mmap, part bodies are slices of it and never copied
+    with open(fpath, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0: #empty files cannot be mapped
+            yield memoryview(b"")
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mm)
+        try:
+            yield view
+        finally:
+            view.release()
+            try:
+                mm.close()
+            except BufferError: #a part is still referenced somewhere, the map is closed when it is collected
+                pass
+
+class _bodyReader:
+    #read-only, seekable file object over a bytes-like body: the SDK only takes bytes/str or objects with read(), and
+    #rewinds those with tell/seek for its own retries; reads copy one block at a time, never the whole body
+    def __init__(self, data):
+        self.view = memoryview(data).cast("B")
+        self.pos = 0
+
+    def __len__(self):
+        return len(self.view)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else min(self.pos+size, len(self.view))
+        data = self.view[self.pos:end].tobytes()
+        self.pos = max(self.pos, end)
+        return data
+
+    def readinto(self, buf):
+        n = min(len(buf), len(self.view)-self.pos)
+        if n <= 0:
+            return 0
+        buf[:n] = self.view[self.pos:self.pos+n]
+        self.pos += n
+        return n
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.pos
+        elif whence == os.SEEK_END:
+            offset += len(self.view)
+        if offset < 0:
+            raise ValueError("negative seek position " + str(offset))
+        self.pos = offset
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def release(self):
+        self.view.release()
+
+def _readParts(source, size):
+    #splits a binary file-like object (pipes included) or an iterable of bytes into size-byte parts, the last may be shorter
+    if hasattr(source, "readinto"):
+        while True:
+            part = bytearray(size)
+            got = 0
+            with memoryview(part) as view:
+                while got < size:
+                    n = source.readinto(view[got:])
+                    if not n:
+                        break
+                    got += n
+            if got:
+                yield part if got == size else part[:got]
+            if got < size:
+                return
+    buf = bytearray()
+    chunks = iter(partial(source.read, size), b"") if hasattr(source, "read") else source
+    for chunk in chunks:
+        buf += chunk
+        while len(buf) >= size:
+            yield buf[:size]
+            del buf[:size]
+    if len(buf):
+        yield buf
+
 class serverconnection:
-    def __init__(self, url, working_dir="", config_file=""):
+    def __init__(self, url, working_dir="", config_file="", storage_client=None, cache_ttl=30.0, cache_size=10000, quiet=False, shared_metrics=None):
         self.print_location = sys.stdout
+        self.quiet = quiet #no progress bars or spinners, for headless runs (messages still go to print_location)
+        #request/transfer counts, bytes and latencies (see stats), shared_metrics lets several connections report together
+        self.metrics = shared_metrics if shared_metrics is not None else metrics()
         self.working_dir = working_dir
         self.url = url
-        if len(config_file) > 0:
-            self.config = from_file(config_file) #custom config file location
+        if storage_client is not None: #injected client (e.g. a local fake for testing), no config needed
+            self.config = None
+            self.storage_client = storage_client
         else:
-            self.config = from_file() #default location (~/.oci/config)
-        self.storage_client = ObjectStorageClient(self.config)
+            if len(config_file) > 0:
+                self.config = from_file(config_file) #custom config file location
+            else:
+                self.config = from_file() #default location (~/.oci/config)
+            self.storage_client = ObjectStorageClient(self.config)
+        self.connections = None #shared cap on concurrent body transfers, see setLimits
+        self.memory = None #shared cap on part/range bytes held in memory, see setLimits
+        self.meta_cache = metacache(cache_ttl, cache_size) #head_object results, invalidated by our own puts/commits
 
     def changeDir(self, working_dir):
         self.working_dir = working_dir
 
+    def setLimits(self, max_connections=0, max_memory=0):
+        #caps shared by every transfer on this connection, across files and threads (0 = unlimited)
+        self.connections = threading.BoundedSemaphore(max_connections) if max_connections else None
+        self.memory = bytebudget(max_memory) if max_memory else None
+
+    @contextmanager
+    def _slot(self, nbytes):
+        #holds nbytes of the memory budget and one connection while a part/range/object body is transferred
+        taken = self.memory.acquire(nbytes) if self.memory is not None else 0
+        try:
+            if self.connections is not None:
+                with self.connections:
+                    yield
+            else:
+                yield
+        finally:
+            if self.memory is not None:
+                self.memory.release(taken)
+
     def toLogfile(self, logfile):
         self.print_location = open(logfile, "a")
 
@@ -30,57 +176,223 @@ class serverconnection:
             self.print_location.close()
         self.print_location = sys.stdout
 
-    def exists(self, namespace, bucket_name, filename, attempts=10):
+    def setQuiet(self, quiet=True):
+        self.quiet = quiet
+
+    def stats(self):
+        #per-operation metrics (see metrics.stats) plus the head_object cache counters; HEADs that went to the
+        #service are requests["head_object"], the ones answered locally are head_cache["hits"]
+        out = self.metrics.stats()
+        out["head_cache"] = {"hits": self.meta_cache.hits, "misses": self.meta_cache.misses, "entries": len(self.meta_cache.entries)}
+        return out
+
+    def resetStats(self):
+        self.metrics.reset()
+        self.meta_cache.hits = 0
+        self.meta_cache.misses = 0
+
+    def _request(self, op, began, nbytes=0, ok=True, attempt=0):
+        #records one SDK call that started at `began` (time.monotonic)
+        self.metrics.record("requests", op, time.monotonic()-began, nbytes, ok, attempt > 0)
+
+    def exists(self, namespace, bucket_name, filename, attempts=10, bypass_cache=False):
         for i in range(attempts):
+            try:
+                return self.headObject(namespace, bucket_name, filename, bypass_cache, i) is not None
+            except Exception as e: #anything but "not found" is worth another try
+                print("Lookup attempt failed:", e, file=self.print_location)
+        return False
+
+    def headObject(self, namespace, bucket_name, object_name, bypass_cache=False, attempt=0):
+        #object metadata headers (content-length, etag, content-md5/opc-multipart-md5, ...) or None if there is no such object
+        #answered from the metadata cache while fresh, bypass_cache forces a round trip (and refreshes the cache)
+        key = (namespace, bucket_name, object_name)
+        if not bypass_cache:
+            hit, headers = self.meta_cache.lookup(key)
+            if hit:
+                return headers
+        began = time.monotonic()
+        try:
             response = self.storage_client.head_object(
                 namespace_name=namespace,
                 bucket_name=bucket_name,
-                object_name=filename
+                object_name=object_name
             )
-            if response.status == 200:
-                return True
+        except Exception as e:
+            if not isinstance(e, oci.exceptions.ServiceError) or e.status != 404:
+                self._request("head_object", began, ok=False, attempt=attempt)
+                raise
+            response = None
+        self._request("head_object", began, attempt=attempt)
+        headers = dict(response.headers) if response is not None and response.status == 200 else None
+        self.meta_cache.store(key, headers)
+        return headers
+
+    def objectInfo(self, namespace, bucket_name, object_name, bypass_cache=False):
+        #size/etag/tier/md5 of an object (None if it does not exist), from the cache when possible
+        headers = self.headObject(namespace, bucket_name, object_name, bypass_cache)
+        if headers is None:
+            return None
+        return {
+            "size": int(headers["content-length"]),
+            "etag": headers.get("etag", ""),
+            "tier": headers.get("storage-tier", ""),
+            "md5": headers.get("content-md5", headers.get("opc-multipart-md5", ""))
+        }
+
+    def listObjects(self, namespace, bucket_name, prefix="", attempts=10, page_size=1000):
+        #yields an ObjectSummary (name, size, etag, storage_tier, md5) for every object whose name starts with prefix, in name
+        #order, fetching one page per list_objects request as the caller iterates; a page that keeps failing raises
+        kwargs = {"fields": "name,size,etag,storageTier,md5", "limit": page_size}
+        if len(prefix):
+            kwargs["prefix"] = prefix
+        while True:
+            for i in range(attempts):
+                began = time.monotonic()
+                try:
+                    response = self.storage_client.list_objects(
+                        namespace_name=namespace,
+                        bucket_name=bucket_name,
+                        **kwargs
+                    )
+                except Exception as e:
+                    self._request("list_objects", began, ok=False, attempt=i)
+                    print("Listing attempt failed:", e, file=self.print_location)
+                    if i == attempts-1:
+                        raise
+                    continue
+                self._request("list_objects", began, attempt=i)
+                break
+            for summary in response.data.objects:
+                yield summary
+            if response.data.next_start_with is None:
+                return
+            kwargs["start"] = response.data.next_start_with
+
+    def _getRange(self, namespace, bucket_name, object_name, fd, start, end, attempts, sizer=None):
+        #runs on a worker thread: fetches one byte range, retrying it independently, and writes it at its offset
+        #every attempt is reported to the sizer (if any) so it can adapt range size and concurrency
+        rangestring = "bytes=" + str(start) + "-" + str(end)
+        for i in range(attempts):
+            with self._slot(end-start+1):
+                began = time.monotonic()
+                ok = False
+                try:
+                    chunk = self.storage_client.get_object(
+                        namespace_name=namespace,
+                        bucket_name=bucket_name,
+                        object_name=object_name,
+                        range=rangestring
+                    )
+                    if chunk.status in (200, 206):
+                        content = chunk.data.content
+                        ok = len(content) == end-start+1 #short read, try again
+                except Exception as e:
+                    print("Range", rangestring, "failed:", e, file=self.print_location)
+                if sizer is not None:
+                    sizer.record(end-start+1, time.monotonic()-began, ok)
+                self._request("get_object", began, end-start+1, ok, i)
+                if ok:
+                    _writeAt(fd, content, start)
+                    return True
         return False
-    def getFile(self, namespace, bucket_name, object_name, filename="", chunk_size=8192, attempts=10) -> str:
+
+    def _saveRanges(self, ckpt, state, fd):
+        #finished ranges are only recorded once their bytes are on disk
+        os.fsync(fd)
+        state["ranges"] = mergeRanges(state["ranges"])
+        ckpt.save(state)
+
+    def getFile(self, namespace, bucket_name, object_name, filename="", chunk_size=0, attempts=10, workers=1, resume=False, max_workers=16, report=None) -> str:
+        #chunk_size is the size of each ranged GET and workers the number of ranges fetched concurrently; chunk_size 0 sizes
+        #ranges automatically, starting from `workers` and adapting both (up to max_workers) to the measured throughput
+        #resume keeps the partial file and a checkpoint of finished ranges on failure, and continues from them on the next call
+        #report, if given, is filled with the sizes/concurrency used (see partsizer.summary)
         local_filename = object_name
         if len(filename) != 0:
             local_filename = filename
         print("Attempting to download file named", object_name, "to current folder as", filename, file=self.print_location)
+        began = time.monotonic()
         #retrieve metadata first
-        metadata = self.storage_client.head_object(
-            namespace_name=namespace,
-            bucket_name=bucket_name,
-            object_name=object_name
-        )
-        if metadata.status != 200:
-            print("ERROR! Status:", metadata.status, file=self.print_location)
+        metadata = self.headObject(namespace, bucket_name, object_name)
+        if metadata is None:
+            print("ERROR! Object", object_name, "not found.", file=self.print_location)
             return "" #file isn't created yet so it's fine
-        osize = int(metadata.headers["content-length"])
-        #after getting stuff, open a file and start writing
+        osize = int(metadata["content-length"])
+        #download into a preallocated partial file, ranges are written at their offsets as they land
+        fpath = os.path.join(self.working_dir, local_filename)
+        ppath = fpath + ".part"
+        etag = metadata.get("etag", "")
+        ckpt = checkpoint(ppath + ".ckpt")
+        state = ckpt.load() if resume else None
+        if state is not None and state.get("object") == [namespace, bucket_name, object_name] and state.get("etag") == etag \
+                and state.get("size") == osize and os.path.isfile(ppath) and getsize(ppath) == osize:
+            state["ranges"] = mergeRanges(state["ranges"])
+            print("Resuming download,", sum(r[1]-r[0]+1 for r in state["ranges"]), "of", osize, "bytes already downloaded.", file=self.print_location)
+        else: #no checkpoint, or the remote object/partial file changed since it was written: start over
+            ckpt.clear()
+            state = {"object": [namespace, bucket_name, object_name], "etag": etag, "size": osize, "ranges": []}
+            with open(ppath, 'wb') as f:
+                f.truncate(osize)
+        if chunk_size:
+            sizer = partsizer.fixed(osize, chunk_size, workers, max_parts=0)
+        else: #ranges are held in memory until written, so they stay smaller than upload parts
+            sizer = partsizer(osize, workers, max_workers, min_part=MiB, max_part=64*MiB, max_parts=0)
+        gaps = missingRanges(state["ranges"], osize)
+
+        def plan():
+            #ranges are cut as they are handed out, so size changes apply to the rest of the object
+            for gap in gaps:
+                pos = gap[0]
+                while pos <= gap[1]:
+                    size = sizer.nextSize(gap[1]-pos+1)
+                    yield pos, pos+size-1
+                    pos += size
+
+        ranges = plan()
+        nxt = next(ranges, None)
+        inflight = {}
         valid_file = True
-        with open(os.path.join(self.working_dir, local_filename), 'wb') as f:
-            for i in tqdm(range(0, osize, chunk_size), desc="DOWNLOADING!"):
-                endat = min(i+chunk_size-1, osize-1)
-                rangestring = str(i) + "-" + str(endat)
-                for j in range(attempts):
-                    chunk = self.storage_client.get_object(
-                        namespace_name=namespace,
-                        bucket_name=bucket_name,
-                        object_name=object_name,
-                        range=rangestring
-                    )
-                    if chunk.status == 200:
-                        break
-                if chunk.status != 200: #tried already, something is broken so exit
-                    valid_file = False
-                    print("ERROR! Status:", chunk.status, file=self.print_location)
-                    break
-                f.write(chunk.content)
-        #if parts could not be reached and file is incomplete, delete the file and return empty string
+        fd = os.open(ppath, os.O_RDWR | getattr(os, "O_BINARY", 0))
+        try:
+            with ThreadPoolExecutor(max_workers=sizer.max_workers) as pool:
+                with tqdm(total=osize, initial=osize-sum(g[1]-g[0]+1 for g in gaps), unit="B", unit_scale=True, desc="DOWNLOADING!", disable=self.quiet) as tq:
+                    while nxt is not None or len(inflight):
+                        while nxt is not None and valid_file and len(inflight) < sizer.concurrency:
+                            fut = pool.submit(self._getRange, namespace, bucket_name, object_name, fd, nxt[0], nxt[1], attempts, sizer)
+                            inflight[fut] = nxt
+                            nxt = next(ranges, None)
+                        if not len(inflight):
+                            break
+                        done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                        for fut in done:
+                            cur = inflight.pop(fut)
+                            if fut.result():
+                                tq.update(cur[1]-cur[0]+1)
+                                state["ranges"].append([cur[0], cur[1]])
+                                if resume and ckpt.due():
+                                    self._saveRanges(ckpt, state, fd)
+                            else: #tried already, something is broken so stop handing out ranges
+                                valid_file = False
+                                print("ERROR! Range", cur[0], "-", cur[1], "could not be downloaded.", file=self.print_location)
+            if resume and not valid_file:
+                self._saveRanges(ckpt, state, fd)
+        finally:
+            os.close(fd)
+        if report is not None:
+            report.update(sizer.summary())
+        self.metrics.record("transfers", "getFile", time.monotonic()-began, sum(g[1]-g[0]+1 for g in gaps), valid_file)
+        #if parts could not be reached and file is incomplete, delete the partial file (unless resuming later) and return empty string
         if not valid_file:
+            if resume:
+                print("File at", local_filename, "could not be fully downloaded, progress kept for the next attempt.", file=self.print_location)
+                return ""
             print("File at", local_filename, "could not be fully downloaded, cleaning up.", file=self.print_location)
-            if os.path.exists(os.path.join(self.working_dir, local_filename)):
-                os.remove(os.path.join(self.working_dir, local_filename))
+            if os.path.exists(ppath):
+                os.remove(ppath)
             return ""
+        os.replace(ppath, fpath) #only now does the finished file replace whatever was there
+        ckpt.clear()
         print("SUCCESS!", file=self.print_location)
         return local_filename #if success, return filename (otherwise would be empty to signal caller something went wrong)
 
@@ -89,126 +401,391 @@ class serverconnection:
             object_name = filename
         print("Attempting to upload file named", filename, "to server as", object_name, file=self.print_location)
         #check if object exists
-        metadata = self.storage_client.head_object(
-            namespace_name=namespace,
-            bucket_name=bucket_name,
-            object_name=object_name
-        )
-        if metadata.status == 200: #object exists (we may need to overwrite)
-            print("Object exists with size", metadata.headers["content-length"], file=self.print_location)
+        metadata = self.headObject(namespace, bucket_name, object_name)
+        if metadata is not None: #object exists (we may need to overwrite)
+            print("Object exists with size", metadata["content-length"], file=self.print_location)
             if not replace_existing:
                 return False
-        spinner = Halo(text='Uploading', spinner='dots')
+        spinner = Halo(text='Uploading', spinner='dots', enabled=not self.quiet)
         spinner.start()
-        with open(os.path.join(self.working_dir, filename), 'rb') as f:
-            fcontent = f.read()
+        began = time.monotonic()
+        fpath = os.path.join(self.working_dir, filename)
+        result = self._putLocal(namespace, bucket_name, object_name, fpath, tier, attempts)
+        spinner.stop()
+        self.metrics.record("transfers", "putFile", time.monotonic()-began, getsize(fpath), result)
+        if result:
+            print("SUCCESS!", file=self.print_location)
+            return True
+        print("FAILURE!", file=self.print_location)
+        return False
+
+    def putStream(self, namespace, bucket_name, source, object_name, chunk_size=8*1024*1024, attempts=10, tier="", workers=1) -> bool:
+        #uploads from a binary file-like object (pipes included) or an iterable of bytes whose length is not known up front
+        #data is read chunk_size bytes at a time, at most workers+1 parts are held in memory; a stream that fits in one
+        #part is sent as a single PUT, anything longer as a multipart upload (which is aborted if it fails)
+        print("Attempting to upload stream to server as", object_name, file=self.print_location)
+        began = time.monotonic()
+        parts = _readParts(source, chunk_size)
+        first = next(parts, bytearray())
+        second = next(parts, None)
+        if second is None:
+            result = self._putObject(namespace, bucket_name, object_name, first, tier, attempts)
+            self.metrics.record("transfers", "putStream", time.monotonic()-began, len(first), result)
+            if result:
+                print("SUCCESS!", file=self.print_location)
+                return True
+            print("FAILURE!", file=self.print_location)
+            return False
+        up_id = self._createUpload(namespace, bucket_name, object_name, tier)
+        if up_id is None:
+            return False
+        commits = []
+        sent = [0]
+        head = [first, second] #the parts read ahead, handed over (and forgotten) like the rest
+        first = second = None
+
+        def partDone(offset, size, part_num, etag):
+            commits.append(oci.object_storage.models.CommitMultipartUploadPartDetails(part_num=part_num, etag=etag))
+            sent[0] += size
+
+        def numbered():
+            offset = 0
+            num = 1
+            while len(head):
+                size = len(head[0])
+                yield offset, num, head.pop(0)
+                offset += size
+                num += 1
+            for body in parts:
+                size = len(body)
+                yield offset, num, body
+                body = None
+                offset += size
+                num += 1
+
+        with tqdm(unit="B", unit_scale=True, desc="UPLOADING!", disable=self.quiet) as tq:
+            failed = self._sendParts(namespace, bucket_name, object_name, up_id, numbered(), attempts, partsizer.fixed(0, chunk_size, workers, max_parts=0), 0, partDone, tq)
+        result = not len(failed) and self._commitUpload(namespace, bucket_name, object_name, up_id, commits, attempts)
+        self.metrics.record("transfers", "putStream", time.monotonic()-began, sent[0], result)
+        if result:
+            print("SUCCESS!", file=self.print_location)
+            return True
+        print("FAILURE! Aborting multipart upload.", file=self.print_location)
+        self._abortUpload(namespace, bucket_name, object_name, up_id)
+        return False
+
+    def _putObject(self, namespace, bucket_name, object_name, body, tier, attempts):
+        #single PUT with retries, returns True on success; body is bytes-like or a binary file object,
+        #which is streamed (and rewound for each attempt) rather than read into memory
+        held = 0
+        reader = None
+        if not hasattr(body, "read"): #the SDK only streams objects with read()
+            held = len(body)
+            body = reader = _bodyReader(body)
+        start = body.tell()
+        length = os.fstat(body.fileno()).st_size-start if reader is None else len(reader)-start
+        try:
+            return self._putBody(namespace, bucket_name, object_name, body, start, length, held, tier, attempts)
+        finally:
+            if reader is not None:
+                reader.release()
+
+    def _putBody(self, namespace, bucket_name, object_name, body, start, length, held, tier, attempts):
+        with self._slot(held):
             for i in range(attempts):
-                response = None
-                if len(tier) != 0:
-                    response = self.storage_client.put_object(
-                        namespace_name=namespace,
-                        bucket_name=bucket_name,
-                        object_name=object_name,
-                        storage_tier=tier,
-                        put_object_body=fcontent
-                    )
-                else:
+                kwargs = {"storage_tier": tier} if len(tier) != 0 else {}
+                body.seek(start)
+                began = time.monotonic()
+                try:
                     response = self.storage_client.put_object(
                         namespace_name=namespace,
                         bucket_name=bucket_name,
                         object_name=object_name,
-                        put_object_body=fcontent
+                        put_object_body=body,
+                        content_length=length,
+                        **kwargs
                     )
+                except Exception as e:
+                    self._request("put_object", began, length, False, i)
+                    print("Upload attempt failed:", e, file=self.print_location)
+                    continue
+                self._request("put_object", began, length, response.status == 200, i)
                 if response.status == 200:
-                    spinner.stop()
-                    print("SUCCESS!", file=self.print_location)
+                    self.meta_cache.invalidate((namespace, bucket_name, object_name))
                     return True
-        spinner.stop()
-        print("FAILURE!", file=self.print_location)
         return False
 
-    def multiPutFile(self, namespace, bucket_name, filename, object_name="", chunk_size=8192, attempts=10, tier="", replace_existing=True):
-        if len(object_name) == 0:
-            object_name = filename
-        # check if object exists
-        metadata = self.storage_client.head_object(
-            namespace_name=namespace,
-            bucket_name=bucket_name,
-            object_name=object_name
-        )
-        if metadata.status == 200:  # object exists (we may need to overwrite)
-            print("Object exists with size", metadata.headers["content-length"], file=self.print_location)
-            if not replace_existing:
-                return False
-        #create upload
+    def _putLocal(self, namespace, bucket_name, object_name, fpath, tier, attempts):
+        with open(fpath, 'rb') as f:
+            return self._putObject(namespace, bucket_name, object_name, f, tier, attempts)
+
+    def _uploadPart(self, namespace, bucket_name, object_name, up_id, part_num, body, attempts, sizer=None):
+        #runs on a worker thread: uploads one part and retries it independently, returns the ETag or None
+        #body is bytes-like, for files a memoryview slice of the mapped file so the part is never copied; it is sent
+        #through a _bodyReader since the SDK only takes bytes or file objects
+        #every attempt is reported to the sizer (if any) so it can adapt part size and concurrency
+        reader = _bodyReader(body)
+        try:
+            with self._slot(len(body)):
+                for i in range(attempts):
+                    began = time.monotonic()
+                    response = None
+                    reader.seek(0)
+                    try:
+                        response = self.storage_client.upload_part(
+                            namespace_name=namespace,
+                            bucket_name=bucket_name,
+                            object_name=object_name,
+                            upload_id=up_id,
+                            upload_part_num=part_num,
+                            upload_part_body=reader,
+                            content_length=len(reader)
+                        )
+                    except Exception as e:
+                        print("Part", part_num, "failed:", e, file=self.print_location)
+                    ok = response is not None and response.status == 200
+                    if sizer is not None:
+                        sizer.record(len(body), time.monotonic()-began, ok)
+                    self._request("upload_part", began, len(body), ok, i)
+                    if ok:
+                        return response.headers["etag"]
+            return None
+        finally:
+            reader.release()
+            if isinstance(body, memoryview):
+                body.release()
+
+    def _sendParts(self, namespace, bucket_name, object_name, up_id, parts, attempts, sizer, max_inflight_bytes, on_part, tq):
+        #uploads (offset, part number, body) tuples taken lazily from `parts`, keeping at most sizer.concurrency parts and
+        #`max_inflight_bytes` bytes in flight, so bodies are only produced (read) when there is room for them
+        #on_part(offset, size, part number, etag) is called on this thread as parts finish; returns the failed parts
+        failed = []
+        inflight = {}
+        inflight_bytes = 0
+        nxt = next(parts, None)
+        with ThreadPoolExecutor(max_workers=sizer.max_workers) as pool:
+            while nxt is not None or len(inflight):
+                while nxt is not None and not len(failed) and len(inflight) < sizer.concurrency:
+                    if max_inflight_bytes and len(inflight) and inflight_bytes+len(nxt[2]) > max_inflight_bytes:
+                        break
+                    cur = (nxt[0], len(nxt[2]), nxt[1])
+                    fut = pool.submit(self._uploadPart, namespace, bucket_name, object_name, up_id, nxt[1], nxt[2], attempts, sizer)
+                    inflight[fut] = cur
+                    inflight_bytes += cur[1]
+                    nxt = next(parts, None)
+                if not len(inflight):
+                    break
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    cur = inflight.pop(fut)
+                    inflight_bytes -= cur[1]
+                    etag = fut.result()
+                    if etag is None:
+                        failed.append(cur)
+                    else:
+                        tq.update(cur[1])
+                        on_part(cur[0], cur[1], cur[2], etag)
+        if isinstance(nxt, tuple) and isinstance(nxt[2], memoryview):
+            nxt[2].release()
+        return failed
+
+    def _createUpload(self, namespace, bucket_name, object_name, tier):
         mpu_details = oci.object_storage.models.CreateMultipartUploadDetails(
             object=object_name)
         if len(tier) != 0:
             mpu_details.storage_tier = tier
         print("Initializing multipart upload.", file=self.print_location)
-        create_response = self.storage_client.create_multipart_upload(
-            namespace_name=namespace,
-            bucket_name=bucket_name,
-            create_multipart_upload_details=mpu_details
-        )
+        began = time.monotonic()
+        try:
+            create_response = self.storage_client.create_multipart_upload(
+                namespace_name=namespace,
+                bucket_name=bucket_name,
+                create_multipart_upload_details=mpu_details
+            )
+        except Exception:
+            self._request("create_multipart_upload", began, ok=False)
+            raise
+        self._request("create_multipart_upload", began, ok=create_response.status == 200)
         if create_response.status != 200:
             print("Could not initialize multipart upload. Status:", create_response.status, file=self.print_location)
-            return False
-        up_id = create_response.data["uploadId"]
-        #make parts
-        fsize = getsize(os.path.join(self.working_dir, filename))
-        wchunks = fsize//chunk_size
-        rchunk = fsize%chunk_size
-        fqueue = []
-        for i in range(wchunks):
-            fqueue.append((i*chunk_size, i+1))
-        if rchunk:
-            fqueue.append((wchunks*chunk_size, wchunks+1))
-        fin_size = len(fqueue)
-        print("Upload will consist of", fin_size, "parts.", file=self.print_location)
-        tattempts = attempts*fin_size #attempts is per-chunk
+            return None
+        return create_response.data.upload_id
+
+    def _uploadedParts(self, namespace, bucket_name, object_name, up_id, attempts=10):
+        #part number -> etag as the server sees it, None if the upload no longer exists (committed, aborted or expired)
+        #any other error is retried, and raised once attempts run out: the upload may well be alive
+        for i in range(attempts):
+            began = time.monotonic()
+            try:
+                response = oci.pagination.list_call_get_all_results(
+                    self.storage_client.list_multipart_upload_parts,
+                    namespace,
+                    bucket_name,
+                    object_name,
+                    up_id
+                )
+            except Exception as e:
+                if isinstance(e, oci.exceptions.ServiceError) and e.status == 404:
+                    self._request("list_multipart_upload_parts", began, attempt=i)
+                    return None
+                self._request("list_multipart_upload_parts", began, ok=False, attempt=i)
+                print("Listing uploaded parts failed:", e, file=self.print_location)
+                if i == attempts-1:
+                    raise
+                continue
+            self._request("list_multipart_upload_parts", began, attempt=i)
+            return {p.part_number: p.etag for p in response.data}
+
+    def _abortUpload(self, namespace, bucket_name, object_name, up_id):
+        began = time.monotonic()
+        try: #best effort, the upload may already be gone
+            self.storage_client.abort_multipart_upload(
+                namespace_name=namespace,
+                bucket_name=bucket_name,
+                object_name=object_name,
+                upload_id=up_id
+            )
+        except oci.exceptions.ServiceError:
+            self._request("abort_multipart_upload", began, ok=False)
+            return
+        self._request("abort_multipart_upload", began)
+
+    def multiPutFile(self, namespace, bucket_name, filename, object_name="", chunk_size=0, attempts=10, tier="", replace_existing=True, workers=1, max_inflight_bytes=0, resume=False, max_workers=16, report=None):
+        #workers: number of parts uploaded concurrently, max_inflight_bytes: cap on part bytes held in memory at once (0 = no cap)
+        #chunk_size 0 sizes parts automatically from the file size and the service limits, then adapts part size and
+        #concurrency (up to max_workers) to the measured throughput; report, if given, is filled with the choices made
+        #resume: record the upload id and finished parts next to the file, and continue that upload on the next call
+        if len(object_name) == 0:
+            object_name = filename
+        # check if object exists
+        metadata = self.headObject(namespace, bucket_name, object_name)
+        if metadata is not None:  # object exists (we may need to overwrite)
+            print("Object exists with size", metadata["content-length"], file=self.print_location)
+            if not replace_existing:
+                return False
+        began = time.monotonic()
+        fpath = os.path.join(self.working_dir, filename)
+        stamp = localStamp(fpath)
+        fsize = stamp[0]
+        ckpt = checkpoint(fpath + ".upload.ckpt")
+        state = ckpt.load() if resume else None
+        finished = {} #part number -> [offset, size, etag] of parts already uploaded
+        up_id = None
+        if state is not None:
+            if state.get("object") == [namespace, bucket_name, object_name] and state.get("local") == stamp:
+                try:
+                    remote = self._uploadedParts(namespace, bucket_name, object_name, state["upload_id"], attempts)
+                except Exception: #cannot tell whether the upload is alive, keep it and the checkpoint for the next call
+                    self.metrics.record("transfers", "multiPutFile", time.monotonic()-began, 0, False)
+                    print("FAILURE! Could not check the upload in the checkpoint.", file=self.print_location)
+                    return False
+                if remote is not None: #upload id is still alive, keep the parts the server agrees on
+                    up_id = state["upload_id"]
+                    chunk_size = state["chunk_size"]
+                    finished = {int(n): p for n, p in state["parts"].items() if remote.get(int(n)) == p[2]}
+                    print("Resuming multipart upload,", len(finished), "parts already uploaded.", file=self.print_location)
+            if up_id is None:
+                print("Checkpoint is stale, restarting upload.", file=self.print_location)
+                self._abortUpload(*state["object"], state["upload_id"]) #it belongs to the object it was started for
+                ckpt.clear()
+        if up_id is None:
+            up_id = self._createUpload(namespace, bucket_name, object_name, tier)
+            if up_id is None:
+                return False
+            state = {"object": [namespace, bucket_name, object_name], "local": stamp, "upload_id": up_id, "chunk_size": chunk_size, "parts": {}}
+            if resume:
+                ckpt.save(state)
+        if chunk_size:
+            sizer = partsizer.fixed(fsize, chunk_size, workers)
+            print("Upload will consist of", -(-fsize//chunk_size), "parts.", file=self.print_location)
+        else:
+            sizer = partsizer(fsize, workers, max_workers)
+            print("Part size chosen automatically, starting at", sizer.part_size, "bytes.", file=self.print_location)
         commits = []
-        #attempt to upload all chunks
-        with open(os.path.join(self.working_dir, filename), 'rb') as f:
-            with tqdm(total=fin_size, desc="UPLOADING!") as tq:
-                while len(fqueue) and tattempts:
-                    cur = fqueue.pop(0)
-                    f.seek(cur[0])
-                    cchunk = f.read(chunk_size)
-                    up_num = cur[1]
-                    upload_part_response = self.storage_client.upload_part(
-                        namespace_name=namespace,
-                        bucket_name=bucket_name,
-                        object_name=object_name,
-                        upload_id=up_id,
-                        upload_part_num=up_num,
-                        upload_part_body=cchunk
-                    )
-                    if upload_part_response.status != 200:
-                        fqueue.append(cur)
+        state["parts"] = {}
+        reused = [0] #bytes of parts taken over from the checkpoint
+
+        def partDone(offset, size, part_num, etag):
+            commits.append(oci.object_storage.models.CommitMultipartUploadPartDetails(part_num=part_num, etag=etag))
+            state["parts"][str(part_num)] = [offset, size, etag]
+
+        def partSent(offset, size, part_num, etag):
+            #saves are throttled like getFile's, reused parts are already in the checkpoint and never trigger one
+            partDone(offset, size, part_num, etag)
+            if resume and ckpt.due():
+                ckpt.save(state)
+
+        #attempt to upload all chunks, parts are slices of the mapped file so memory stays at the parts in flight
+        with _mapped(fpath) as view, tqdm(total=fsize, unit="B", unit_scale=True, desc="UPLOADING!", disable=self.quiet) as tq:
+
+            def plan():
+                #parts are cut as they are handed out, so size changes apply to the rest of the file; a part from the
+                #checkpoint is reused when it has the number and offset the walk arrives at
+                offset = 0
+                part_num = 1
+                while offset < fsize:
+                    done = finished.get(part_num)
+                    if done is not None and done[0] == offset:
+                        partDone(done[0], done[1], part_num, done[2])
+                        reused[0] += done[1]
+                        tq.update(done[1])
+                        offset += done[1]
                     else:
-                        commits.append(oci.object_storage.models.CommitMultipartUploadPartDetails(
-                            part_num=up_num,
-                            etag=upload_part_response.data["ETag"])
-                        )
-                        tq.update(1)
-                    tattempts -= 1
-        if len(fqueue):
-            print("FAILURE!", len(fqueue), "parts could not be uploaded,", attempts*fin_size, "attempts used.", file=print_location)
+                        size = sizer.nextSize(fsize-offset, part_num)
+                        yield offset, part_num, view[offset:offset+size]
+                        offset += size
+                    part_num += 1
+
+            failed = self._sendParts(namespace, bucket_name, object_name, up_id, plan(), attempts, sizer, max_inflight_bytes, partSent, tq)
+        if report is not None:
+            report.update(sizer.summary())
+            report["part_sizes"] = [state["parts"][n][1] for n in sorted(state["parts"], key=int)]
+        sent = sum(p[1] for p in state["parts"].values())-reused[0]
+        if len(failed):
+            self.metrics.record("transfers", "multiPutFile", time.monotonic()-began, sent, False)
+            print("FAILURE!", len(failed), "parts could not be uploaded,", attempts, "attempts per part.", file=self.print_location)
+            self._failUpload(namespace, bucket_name, object_name, up_id, resume, ckpt, state)
             return False
         #attempt to commit
+        result = self._commitUpload(namespace, bucket_name, object_name, up_id, commits, attempts)
+        self.metrics.record("transfers", "multiPutFile", time.monotonic()-began, sent, result)
+        if result:
+            ckpt.clear()
+            print("SUCCESS!", file=self.print_location)
+            return True
+        print("Could not commit upload!", file=self.print_location)
+        self._failUpload(namespace, bucket_name, object_name, up_id, resume, ckpt, state)
+        return False
+
+    def _failUpload(self, namespace, bucket_name, object_name, up_id, resume, ckpt, state):
+        #a resumable upload keeps its parts and records all finished ones for the next call, any other is aborted
+        #so its parts are not left behind on the server
+        if resume:
+            ckpt.save(state)
+            return
+        print("Aborting multipart upload.", file=self.print_location)
+        self._abortUpload(namespace, bucket_name, object_name, up_id)
+
+    def _commitUpload(self, namespace, bucket_name, object_name, up_id, commits, attempts):
+        commits = sorted(commits, key=lambda c: c.part_num) #parts finish out of order, commit wants them by number
         for i in range(attempts):
-            commit_response = self.storage_client.commit_multipart_upload(
-                namespace_name=namespace,
-                bucket_name=bucket_name,
-                object_name=object_name,
-                upload_id=up_id,
-                commit_multipart_upload_details=oci.object_storage.models.CommitMultipartUploadDetails(
-                    parts_to_commit=commits
+            began = time.monotonic()
+            try:
+                commit_response = self.storage_client.commit_multipart_upload(
+                    namespace_name=namespace,
+                    bucket_name=bucket_name,
+                    object_name=object_name,
+                    upload_id=up_id,
+                    commit_multipart_upload_details=oci.object_storage.models.CommitMultipartUploadDetails(
+                        parts_to_commit=commits
+                    )
                 )
-            )
+            except Exception as e:
+                self._request("commit_multipart_upload", began, ok=False, attempt=i)
+                print("Commit attempt failed:", e, file=self.print_location)
+                continue
+            self._request("commit_multipart_upload", began, ok=commit_response.status == 200, attempt=i)
             if commit_response.status == 200:
-                print("SUCCESS!", file=self.print_location)
+                self.meta_cache.invalidate((namespace, bucket_name, object_name))
                 return True
-        print("Could not commit upload!", file=self.print_location)
         return False
@@ -0,0 +1,199 @@
+import asyncio
+import io
+import json
+import os
+import random
+
+import pytest
+
+from asyncserverconnection import asyncserverconnection
+from checkpoint import checkpoint
+from fakestorage import fakestorage
+from partsizer import MiB
+from serverconnection import serverconnection
+
+NS = "ns"
+BK = "bucket"
+
+
+@pytest.fixture
+def fake():
+    client = fakestorage(seed=7)
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def server(fake, tmp_path):
+    conn = serverconnection("", str(tmp_path), storage_client=fake, quiet=True)
+    conn.print_location = open(os.devnull, "w")
+    yield conn
+    conn.print_location.close()
+
+
+def _write(path, size):
+    data = os.urandom(size)
+    with open(path, "wb") as f:
+        f.write(data)
+    return data
+
+
+def _stored(fake, name):
+    with open(fake.objects[(NS, BK, name)]["path"], "rb") as f:
+        return f.read()
+
+
+def test_fake_rejects_bodies_the_sdk_rejects(fake):
+    with pytest.raises(TypeError):
+        fake.put_object(NS, BK, "o", memoryview(b"abc"))
+    up_id = fake.create_multipart_upload(NS, BK, type("d", (), {"object": "o", "storage_tier": None})()).data.upload_id
+    with pytest.raises(TypeError):
+        fake.upload_part(NS, BK, "o", up_id, 1, bytearray(b"abc"))
+
+
+def test_multipart_upload_commits_concurrent_parts_in_order(fake, server, tmp_path):
+    fake.latency = 0.01
+    data = _write(tmp_path / "f", 35*MiB+5)
+    assert server.multiPutFile(NS, BK, "f", "obj", 10*MiB, workers=4)
+    assert fake.stats()["calls"]["upload_part"] == 4
+    assert _stored(fake, "obj") == data
+    assert not len(fake.uploads)
+
+
+def test_multipart_upload_auto_sizes_parts(fake, server, tmp_path):
+    data = _write(tmp_path / "f", 40*MiB)
+    report = {}
+    assert server.multiPutFile(NS, BK, "f", "obj", workers=2, report=report)
+    assert sum(report["part_sizes"]) == len(data)
+    assert _stored(fake, "obj") == data
+
+
+def test_put_file_and_stream(fake, server, tmp_path):
+    data = _write(tmp_path / "f", 3*MiB)
+    assert server.putFile(NS, BK, "f", "single")
+    assert _stored(fake, "single") == data
+    assert server.putStream(NS, BK, io.BytesIO(data), "stream", chunk_size=MiB, workers=2)
+    assert fake.stats()["calls"]["upload_part"] == 3
+    assert _stored(fake, "stream") == data
+    assert server.putStream(NS, BK, iter([data[:100], data[100:300]]), "small")
+    assert _stored(fake, "small") == data[:300]
+
+
+def test_ranged_download(fake, server, tmp_path):
+    data = os.urandom(5*MiB+3)
+    fake.put_object(NS, BK, "obj", data)
+    fake.resetStats()
+    assert server.getFile(NS, BK, "obj", "out", MiB, workers=4) == "out"
+    assert (tmp_path / "out").read_bytes() == data
+    assert fake.stats()["calls"]["get_object"] == 6
+    assert not (tmp_path / "out.part").exists()
+
+
+def test_download_missing_object(server, tmp_path):
+    assert server.getFile(NS, BK, "nothing", "out") == ""
+    assert not (tmp_path / "out.part").exists()
+
+
+def test_upload_resumes_after_failures(fake, server, tmp_path):
+    data = _write(tmp_path / "f", 60*MiB)
+    fake.failure_rate = 0.5
+    assert not server.multiPutFile(NS, BK, "f", "obj", 10*MiB, attempts=1, workers=1, resume=True)
+    assert (tmp_path / "f.upload.ckpt").exists()
+    done = len(next(iter(fake.uploads.values()))["parts"])
+    fake.failure_rate = 0.0
+    fake.resetStats()
+    assert server.multiPutFile(NS, BK, "f", "obj", 10*MiB, workers=2, resume=True)
+    assert fake.stats()["calls"]["upload_part"] == 6-done
+    assert _stored(fake, "obj") == data
+    assert not (tmp_path / "f.upload.ckpt").exists()
+
+
+def test_upload_checkpoint_saves_are_throttled(fake, server, tmp_path, monkeypatch):
+    saves = []
+    monkeypatch.setattr(checkpoint, "save", lambda self, state: saves.append(len(state["parts"])))
+    _write(tmp_path / "f", 256*1024)
+    fake.failing = {"upload_part"}
+    fake.random = random.Random(0)
+    fake.failure_rate = 0.02
+    assert not server.multiPutFile(NS, BK, "f", "obj", 1024, attempts=1, resume=True)
+    #created, then one final save with everything finished (all within the throttle interval)
+    assert len(saves) == 2 and saves[-1] == len(next(iter(fake.uploads.values()))["parts"]) > 1
+
+
+def test_upload_list_parts_errors_keep_the_upload(fake, server, tmp_path):
+    data = _write(tmp_path / "f", 30*MiB)
+    fake.failure_rate = 1.0
+    fake.failing = {"upload_part"}
+    assert not server.multiPutFile(NS, BK, "f", "obj", 10*MiB, attempts=1, resume=True)
+    fake.failing = {"list_multipart_upload_parts"}
+    assert not server.multiPutFile(NS, BK, "f", "obj", 10*MiB, attempts=2, resume=True)
+    assert fake.stats()["calls"]["list_multipart_upload_parts"] == 2
+    assert "abort_multipart_upload" not in fake.stats()["calls"] and len(fake.uploads) == 1
+    assert (tmp_path / "f.upload.ckpt").exists()
+    fake.failure_rate = 0.0
+    assert server.multiPutFile(NS, BK, "f", "obj", 10*MiB, resume=True)
+    assert _stored(fake, "obj") == data
+
+
+def test_stale_upload_is_aborted_for_its_own_object(fake, server, tmp_path):
+    data = _write(tmp_path / "f", 30*MiB)
+    fake.failure_rate = 1.0
+    assert not server.multiPutFile(NS, BK, "f", "old", 10*MiB, attempts=1, resume=True)
+    fake.failure_rate = 0.0
+    assert server.multiPutFile(NS, BK, "f", "new", 10*MiB, resume=True)
+    assert _stored(fake, "new") == data
+    assert not len(fake.uploads)
+
+
+@pytest.mark.parametrize("failing", ["upload_part", "commit_multipart_upload"])
+def test_failed_upload_without_resume_is_aborted(fake, server, tmp_path, failing):
+    _write(tmp_path / "f", 30*MiB)
+    fake.failing = {failing}
+    fake.failure_rate = 1.0
+    assert not server.multiPutFile(NS, BK, "f", "obj", 10*MiB, attempts=2)
+    assert not len(fake.uploads)
+    assert not (tmp_path / "f.upload.ckpt").exists()
+
+
+def test_download_resumes_after_failures(fake, server, tmp_path):
+    data = os.urandom(8*MiB)
+    fake.put_object(NS, BK, "obj", data)
+    fake.failing = {"get_object"}
+    fake.random = random.Random(0) #lets three ranges through, then fails one
+    fake.failure_rate = 0.3
+    assert server.getFile(NS, BK, "obj", "out", MiB, attempts=1, workers=1, resume=True) == ""
+    assert (tmp_path / "out.part").exists()
+    with open(tmp_path / "out.part.ckpt") as f:
+        done = sum(r[1]-r[0]+1 for r in json.load(f)["ranges"])//MiB
+    assert done == 3
+    fake.failure_rate = 0.0
+    fake.resetStats()
+    assert server.getFile(NS, BK, "obj", "out", MiB, workers=2, resume=True) == "out"
+    assert fake.stats()["calls"]["get_object"] == 8-done
+    assert (tmp_path / "out").read_bytes() == data
+
+
+def test_retries_are_counted(fake, server, tmp_path):
+    _write(tmp_path / "f", 30*MiB)
+    fake.failure_rate = 0.3
+    assert server.multiPutFile(NS, BK, "f", "obj", 10*MiB, workers=3)
+    parts = server.stats()["requests"]["upload_part"]
+    assert parts["count"] == fake.stats()["calls"]["upload_part"]
+    assert parts["retries"] == parts["errors"] == parts["count"]-3
+
+
+def test_async_transfers_default_to_auto_sizes(fake, tmp_path):
+    conn = asyncserverconnection("", str(tmp_path), storage_client=fake)
+    conn.server.print_location = open(os.devnull, "w")
+    data = _write(tmp_path / "f", 25*MiB)
+
+    async def run():
+        assert await conn.multiPutFile(NS, BK, "f", "obj", workers=2)
+        assert await conn.getFile(NS, BK, "obj", "out", workers=2) == "out"
+
+    asyncio.run(run())
+    conn.close()
+    conn.server.print_location.close()
+    assert _stored(fake, "obj") == data
+    assert (tmp_path / "out").read_bytes() == data
+    assert not len(fake.uploads)